@@ -1,19 +1,132 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form
-from supabase import create_client
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Header
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from datetime import date, datetime, timedelta
+from supabase_client import get_supabase, stream_upload
+from cache_utils import IdempotencyStore
+from application_stats import application_counters
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_fields, fetch_page
+from response_models import ApplicationPage, ApplicationResponse, ApplicationChanges
+from delta_sync import fetch_changes, record_deletes
+import asyncio
+import csv
+import io
+import json
 import os
 import uuid
-from dotenv import load_dotenv
 from auth import get_current_user, check_admin_or_subadmin
-from cloudinary_utils import upload_image
-
-load_dotenv()
 
 jobapply_router = APIRouter(prefix="/jobapply", tags=["jobapply"])
 
-supabase = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+# Resume upload limits, files are streamed to storage in chunks of RESUME_CHUNK_SIZE
+RESUME_MAX_BYTES = int(os.getenv("RESUME_MAX_BYTES", str(5 * 1024 * 1024)))
+RESUME_CHUNK_SIZE = 64 * 1024
+PDF_MAGIC = b"%PDF-"
+
+
+class ResumeTooLarge(Exception):
+    pass
+
+
+# Check the pdf header and size, then stream the resume to the resumes bucket
+async def upload_resume(resume, file_name):
+    # size is known when the multipart parser already spooled the file
+    if resume.size is not None and resume.size > RESUME_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Resume is too large")
+    first_chunk = await resume.read(RESUME_CHUNK_SIZE)
+    if not first_chunk.startswith(PDF_MAGIC):
+        raise HTTPException(status_code=400, detail="Resume must be a PDF file")
+
+    async def chunks():
+        sent = 0
+        chunk = first_chunk
+        while chunk:
+            sent += len(chunk)
+            if sent > RESUME_MAX_BYTES:
+                raise ResumeTooLarge()
+            yield chunk
+            chunk = await resume.read(RESUME_CHUNK_SIZE)
+
+    try:
+        await stream_upload("resumes", file_name, chunks(), "application/pdf")
+    except ResumeTooLarge:
+        raise HTTPException(status_code=413, detail="Resume is too large")
+
+
+# Columns the applications list can project with ?fields=
+APPLICATION_FIELDS = {
+    "job_id": "job_id",
+    "title": "title",
+    "applicant_name": "applicant_name",
+    "user_email": "user_email",
+    "resume_url": "resume_url",
+    "phone_number": "phone_number",
+    "status": "status",
+    "jobs": "jobs(title)",
+}
+
+# Columns of the export, jobs(title) comes out as job_title
+EXPORT_COLUMNS = (
+    "id", "job_id", "job_title", "title", "applicant_name", "user_email",
+    "phone_number", "status", "resume_url", "created_at",
 )
+EXPORT_SELECT = "id,job_id,title,applicant_name,user_email,phone_number,status,resume_url,created_at,jobs(title)"
+# Rows fetched per query while exporting, at most two pages are in memory at a time
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+
+# Apply job responses by Idempotency-Key, so a client retry doesn't upload or insert twice
+apply_idempotency = IdempotencyStore()
+
+
+# Upload the resume and insert the application in one statement. The table has a unique
+# (job_id, user_email) constraint and a foreign key on job_id, so duplicates and unknown
+# jobs are rejected by the insert itself instead of two extra queries before it
+async def submit_application(job_id, user_email, title, name, phone_number, resume):
+    supabase = get_supabase()
+    #resume optional
+    resume_url = None #default none
+    file_name = None
+    if resume:
+        file_name = f"{uuid.uuid4()}.pdf"
+        # we have to store resume in supabase storage, streamed in chunks
+        await upload_resume(resume, file_name)
+        #Now get the resume url
+        resume_url = await supabase.storage.from_("resumes").get_public_url(file_name)
+
+    # Insert application
+    try:
+        response = await supabase.table("applications").insert({
+            "job_id": job_id,
+            "title": title,
+            "user_email": user_email,
+            "applicant_name": name,
+            "resume_url": resume_url,
+            "phone_number": phone_number,
+            "status": "Applied"
+        }).execute()
+    except Exception as e:
+        # the supabase sdk is imported by the clients container on first use, not here
+        from postgrest.exceptions import APIError
+        if not isinstance(e, APIError):
+            raise
+        # the application was rejected, don't keep its resume
+        if file_name:
+            try:
+                await supabase.storage.from_("resumes").remove([file_name])
+            except Exception as cleanup_error:
+                print(f"Could not remove resume {file_name}: {cleanup_error}")
+        if e.code == "23505":  # unique_violation
+            raise HTTPException(status_code=400, detail="You have already applied for this job")
+        if e.code in ("23503", "22P02"):  # foreign_key_violation / invalid uuid
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise
+
+    application_counters.added(response.data[0])
+    return {
+        "message": "Application submitted successfully",
+        "application_id": response.data[0]["id"]
+    }
+
 
 # user section Apply for a job
 @jobapply_router.post("/job_apply/{job_id}")
@@ -23,82 +136,89 @@ async def apply_job(
     title: str = Form(...),
     name: str = Form(...),
     phone_number: str = Form(None),
-    resume: UploadFile = File(None)
+    resume: UploadFile = File(None),
+    idempotency_key: Optional[str] = Header(None),
 ):
     try:
-       
-        # Check if job exists
-        job_check = supabase.table("jobs").select("id").eq("id", job_id).single().execute()
-        if not job_check.data:
-            raise HTTPException(status_code=404, detail="Job not found")
-        
-        # Check if already applied
-        existing = supabase.table("applications").select("id").eq("job_id", job_id).eq("user_email", user_email).execute()
-        if existing.data:
-            raise HTTPException(status_code=400, detail="You have already applied for this job")
-        
-        #resume optional
-        resume_url = None #default none
-        if resume:
-          file_name = f"{uuid.uuid4()}.pdf"
-
-        # we have to store resume in supabase storage
-          supabase.storage.from_("resumes").upload(
-            file_name,
-            await resume.read(),
-            {"content-type": resume.content_type}
-        )
-        #Now get the resume url
-          resume_url = supabase.storage.from_("resumes").get_public_url(file_name)
+        async def submit():
+            return await submit_application(job_id, user_email, title, name, phone_number, resume)
+
+        # same key again -> same response, without a second upload or insert
+        if idempotency_key:
+            return await apply_idempotency.run((job_id, idempotency_key), submit)
+        return await submit()
 
-        # Insert application
-        response = supabase.table("applications").insert({
-            "job_id": job_id,
-            "title": title,
-            "user_email": user_email,
-            "applicant_name": name,
-            "resume_url": resume_url,
-            "phone_number": phone_number,
-            "status": "Applied"
-        }).execute()
-        
-        return {
-            "message": "Application submitted successfully",
-            "application_id": response.data[0]["id"]
-        }
-    
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error applying for job: {str(e)}")
 
-#admin section Get number of applicants
+#admin section Get number of applicants, served from the in-memory counters
 @jobapply_router.get("/{job_id}/applicants/count")
-def get_applicants(job_id: str):
-    #check for unique userid
-    response = supabase.table("applications")\
-    .select("user_id",count="exact")\
-    .eq("job_id", job_id).execute()
-    return {"total applicants": response.count}
+async def get_applicants(job_id: str):
+    await application_counters.ensure_fresh()
+    return {"total applicants": application_counters.job_counts(job_id)["total"]}
+
+#admin section Applicant counts by status for all jobs, or ?job_ids=a,b for some
+@jobapply_router.get("/applicants/counts")
+async def get_applicant_counts(job_ids: Optional[str] = None):
+    try:
+        await application_counters.ensure_fresh()
+        ids = [job_id.strip() for job_id in job_ids.split(",") if job_id.strip()] if job_ids else None
+        return {"counts": application_counters.counts(ids)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error counting applicants: {str(e)}")
 
 # admin section Get all applications for a user
-@jobapply_router.get("/my_applications")
-def get_my_applications():
+@jobapply_router.get("/my_applications", response_model=ApplicationPage, response_model_exclude_unset=True)
+async def get_my_applications(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
     try:
-        #Get applications in order
-        response = supabase.table("applications").select(
-            "id,applicant_name,user_email,status,jobs(title) ,phone_number,created_at"
-        ).order("created_at", desc=True).execute()
-        
-        return {"applications": response.data}
+        #Get one page of applications in order
+        columns = parse_fields(
+            fields,
+            APPLICATION_FIELDS,
+            default="id,applicant_name,user_email,status,jobs(title),phone_number,created_at",
+        )
+        query = get_supabase().table("applications").select(columns)
+        applications, next_cursor = await fetch_page(query, cursor, limit)
+
+        return {"applications": applications, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching applications: {str(e)}")
 
+# admin section Applications created, updated or withdrawn since ?since= (the sync_token of
+# the previous call, none for a first full sync). Call again with the new token while has_more
+@jobapply_router.get("/my_applications/sync", response_model=ApplicationChanges, response_model_exclude_unset=True)
+async def sync_applications(
+    since: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    try:
+        await check_admin_or_subadmin(user)
+        columns = parse_fields(
+            fields,
+            APPLICATION_FIELDS,
+            default="id,applicant_name,user_email,status,jobs(title),phone_number,created_at",
+        )
+        return await fetch_changes("applications", columns, since, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error syncing applications: {str(e)}")
+
 # admin section Get single application details
-@jobapply_router.get("/my_applications/{app_id}")
-def get_application(app_id: str):
+@jobapply_router.get("/my_applications/{app_id}", response_model=ApplicationResponse, response_model_exclude_unset=True)
+async def get_application(app_id: str):
     try:
-        application = supabase.table("applications").select(
+        application = await get_supabase().table("applications").select(
             "id, job_id, applicant_name, user_email, status, created_at, jobs(title)"
         ).eq("id", app_id).single().execute()
         
@@ -112,16 +232,141 @@ def get_application(app_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching application: {str(e)}")
 
+# "2026-01-01" or a full timestamp. A date given as the end of the range includes that whole day
+def parse_date_bound(value, name, end=False):
+    try:
+        if len(value) == 10:
+            day = date.fromisoformat(value)
+            return (day + timedelta(days=1) if end else day).isoformat()
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, use YYYY-MM-DD or an ISO timestamp")
+
+
+def split_values(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def export_row(row):
+    row = dict(row)
+    job = row.pop("jobs", None) or {}
+    row["job_title"] = job.get("title")
+    return row
+
+
+# Spreadsheets run cells starting with these as formulas, applicant input must not
+def csv_safe(value):
+    if value is None:
+        return ""
+    value = str(value)
+    return "'" + value if value[:1] in ("=", "+", "-", "@", "\t", "\r") else value
+
+
+def ndjson_chunk(rows):
+    return "".join(json.dumps(export_row(row), ensure_ascii=False) + "\n" for row in rows)
+
+
+def csv_chunk(rows, header=False):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        row = export_row(row)
+        writer.writerow([csv_safe(row.get(column)) for column in EXPORT_COLUMNS])
+    return out.getvalue()
+
+
+# Returns fetch(cursor) -> (rows, next cursor) over the filtered applications, oldest first
+def export_pages(job_ids, statuses, created_from, created_to):
+    async def fetch(cursor):
+        query = get_supabase().table("applications").select(EXPORT_SELECT)
+        if job_ids:
+            query = query.in_("job_id", job_ids)
+        if statuses:
+            query = query.in_("status", statuses)
+        if created_from:
+            query = query.gte("created_at", created_from)
+        if created_to:
+            query = query.lt("created_at", created_to)
+        return await fetch_page(query, cursor, EXPORT_PAGE_SIZE, desc=False)
+
+    return fetch
+
+
+# The next page is already being fetched while the current one is sent to the client
+async def stream_export(first_page, fetch, fmt):
+    rows, cursor = first_page
+    header = True
+    next_page = None
+    try:
+        while True:
+            next_page = asyncio.create_task(fetch(cursor)) if cursor else None
+            if fmt == "csv":
+                yield csv_chunk(rows, header)
+                header = False
+            elif rows:
+                yield ndjson_chunk(rows)
+            if next_page is None:
+                return
+            rows, cursor = await next_page
+            next_page = None
+    except Exception as e:
+        # the status line is already sent, the client sees a cut off download
+        print(f"Application export failed: {e}")
+        raise
+    finally:
+        # client went away in the middle of the export
+        if next_page is not None:
+            next_page.cancel()
+
+
+# admin section Export every application (or the filtered ones) as NDJSON or CSV.
+# e.g. /jobapply/applications/export?format=csv&job_id=a,b&status=Applied&created_from=2026-01-01&created_to=2026-01-31
+# The rows are streamed page by page, memory use does not grow with the number of applications
+@jobapply_router.get("/applications/export")
+async def export_applications(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    job_id: Optional[str] = None,
+    status: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    try:
+        await check_admin_or_subadmin(user)
+        fetch = export_pages(
+            split_values(job_id) if job_id else None,
+            split_values(status) if status else None,
+            parse_date_bound(created_from, "created_from") if created_from else None,
+            parse_date_bound(created_to, "created_to", end=True) if created_to else None,
+        )
+        # the first page is fetched here so a failing query is still a normal error response
+        first_page = await fetch(None)
+        media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+        file_name = f"applications-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{format}"
+        return StreamingResponse(
+            stream_export(first_page, fetch, format),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{file_name}"'},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exporting applications: {str(e)}")
+
+
 # Admin section Update application status
 @jobapply_router.patch("/applications/{app_id}/status")
-def update_application_status(app_id: str, status: str):
+async def update_application_status(app_id: str, status: str):
     try:
-        response = supabase.table("applications").update({
+        response = await get_supabase().table("applications").update({
             "status": status,
             }).eq("id", app_id).execute()
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Application not found")
+        application_counters.updated(response.data[0])
         
         return {"message": "Application status updated successfully"}
     except HTTPException:
@@ -131,9 +376,12 @@ def update_application_status(app_id: str, status: str):
 
 # Admin section delete application
 @jobapply_router.delete("/applications/{app_id}")
-def withdraw_application(app_id: str, user=Depends(get_current_user)):
+async def withdraw_application(app_id: str, user=Depends(get_current_user)):
     try:
-        supabase.table("applications").delete().eq("id", app_id).execute()
+        response = await get_supabase().table("applications").delete().eq("id", app_id).execute()
+        for row in response.data:
+            application_counters.removed(row)
+        await record_deletes("applications", response.data)
         return {"message": "Application withdrawn successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error withdrawing application: {str(e)}")
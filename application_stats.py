@@ -0,0 +1,251 @@
+import asyncio
+import functools
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from datetime import timedelta
+from supabase_client import get_supabase
+from pagination import fetch_page
+
+# Counters are rebuilt from the table after this many seconds, so writes made by
+# other workers or directly in supabase are picked up
+STATS_RESEED_SECONDS = float(os.getenv("APPLICATION_STATS_RESEED_SECONDS", "300"))
+SEED_PAGE_SIZE = 1000
+
+
+# Day of a supabase timestamp ("2026-01-05T10:00:00+00:00" -> "2026-01-05"), timestamps are UTC
+def day_of(created_at):
+    return created_at[:10] if created_at else None
+
+
+def decrement(counter, key):
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+
+# Marks an incremental update of SeededCounters. Updates made while seed() reads the
+# table are recorded (only the outermost call when one update calls another) and
+# applied again to the new counts, the pages read before the write don't have it
+def counter_update(method):
+    @functools.wraps(method)
+    def update(self, value):
+        if self._updating:
+            return method(self, value)
+        if self._journal is not None:
+            self._journal.append((update, value))
+        self._updating = True
+        try:
+            return method(self, value)
+        finally:
+            self._updating = False
+    return update
+
+
+# Counters seeded by paging through one table, rebuilt every STATS_RESEED_SECONDS
+class SeededCounters(ABC):
+    def __init__(self):
+        self.seeded_at = None
+        self._lock = asyncio.Lock()
+        self._refresh = None
+        self._journal = None
+        self._updating = False
+
+    # All rows of the table, page by page
+    @abstractmethod
+    async def fetch(self):
+        pass
+
+    # Replace the counts with the ones of these rows
+    @abstractmethod
+    def rebuild(self, rows):
+        pass
+
+    async def seed(self):
+        self._journal = []
+        try:
+            rows = await self.fetch()
+            journal = self._journal
+        finally:
+            self._journal = None
+        self.rebuild(rows)
+        for update, value in journal:
+            update(self, value)
+        self.seeded_at = time.monotonic()
+
+    # Seeded on first use. After that a reseed runs in the background once the counts are
+    # STATS_RESEED_SECONDS old, and the current counts are served meanwhile
+    async def ensure_fresh(self):
+        if self.seeded_at is None:
+            async with self._lock:
+                if self.seeded_at is None:
+                    await self.seed()
+            return
+        if time.monotonic() - self.seeded_at >= STATS_RESEED_SECONDS and self._refresh is None:
+            self._refresh = asyncio.create_task(self._reseed())
+
+    async def _reseed(self):
+        try:
+            async with self._lock:
+                await self.seed()
+        except Exception as e:
+            print(f"Could not reseed {type(self).__name__}: {e}")
+        finally:
+            self._refresh = None
+
+
+# Page through a table and return all rows with these columns
+async def fetch_all(table, columns):
+    rows = []
+    cursor = None
+    while True:
+        query = get_supabase().table(table).select(columns)
+        page, cursor = await fetch_page(query, cursor, SEED_PAGE_SIZE)
+        rows.extend(page)
+        if cursor is None:
+            return rows
+
+
+# Applicant counts per job and status, and per job and day the application came in.
+# Seeded once from the applications table and then kept up to date by the handlers
+# that write applications
+class ApplicationCounters(SeededCounters):
+    def __init__(self):
+        super().__init__()
+        self.by_job = defaultdict(Counter)  # job_id -> Counter({status: count})
+        self.by_status = Counter()  # status -> count over all jobs
+        self.daily = defaultdict(Counter)  # "2026-01-05" -> Counter({job_id: count})
+        self.apps = {}  # application id -> (job_id, status, day)
+
+    async def fetch(self):
+        return await fetch_all("applications", "id,job_id,status,created_at")
+
+    def rebuild(self, rows):
+        self.by_job = defaultdict(Counter)
+        self.by_status = Counter()
+        self.daily = defaultdict(Counter)
+        self.apps = {}
+        for row in rows:
+            self._add(row["id"], row["job_id"], row["status"], day_of(row.get("created_at")))
+
+    def _add(self, app_id, job_id, status, day):
+        self.apps[app_id] = (job_id, status, day)
+        self.by_job[job_id][status] += 1
+        self.by_status[status] += 1
+        if day:
+            self.daily[day][job_id] += 1
+
+    # ---- incremental updates, rows are what supabase returned from the write ----
+    @counter_update
+    def added(self, row):
+        if row["id"] in self.apps:
+            return self.updated(row)
+        self._add(row["id"], row.get("job_id"), row.get("status"), day_of(row.get("created_at")))
+
+    @counter_update
+    def removed(self, row):
+        old = self.apps.pop(row["id"], None)
+        if old is None:
+            return
+        job_id, status, day = old
+        decrement(self.by_job[job_id], status)
+        if not self.by_job[job_id]:
+            del self.by_job[job_id]
+        decrement(self.by_status, status)
+        if day:
+            decrement(self.daily[day], job_id)
+            if not self.daily[day]:
+                del self.daily[day]
+
+    @counter_update
+    def updated(self, row):
+        old = self.apps.get(row["id"])
+        if old is None:
+            return self.added(row)
+        job_id = row.get("job_id", old[0])
+        status = row.get("status", old[1])
+        if (job_id, status) == old[:2]:
+            return
+        self.removed(row)
+        self._add(row["id"], job_id, status, old[2])
+
+    # A deleted job takes its applications with it (or leaves them without a job),
+    # either way they no longer count for it
+    @counter_update
+    def job_removed(self, job_id):
+        for app_id in [app_id for app_id, old in self.apps.items() if old[0] == job_id]:
+            self.removed({"id": app_id})
+
+    # ---- reads ----
+    def job_counts(self, job_id):
+        statuses = self.by_job.get(job_id, Counter())
+        return {"total": sum(statuses.values()), "by_status": dict(statuses)}
+
+    def counts(self, job_ids=None):
+        job_ids = self.by_job.keys() if job_ids is None else job_ids
+        return {job_id: self.job_counts(job_id) for job_id in job_ids}
+
+    def status_counts(self, job_ids=None):
+        if job_ids is None:
+            return dict(self.by_status)
+        total = Counter()
+        for job_id in job_ids:
+            total.update(self.by_job.get(job_id, Counter()))
+        return dict(total)
+
+    # One bucket per day from `start` to `end` (dates, inclusive), empty days included
+    def daily_counts(self, start, end, job_ids=None):
+        buckets = []
+        day = start
+        while day <= end:
+            per_job = self.daily.get(day.isoformat(), Counter())
+            if job_ids is not None:
+                per_job = Counter({job_id: per_job[job_id] for job_id in job_ids if per_job[job_id]})
+            buckets.append({"date": day.isoformat(), "total": sum(per_job.values()), "by_job": dict(per_job)})
+            day += timedelta(days=1)
+        return buckets
+
+
+# Jobs by status (live / closed), seeded from the jobs table and updated by the job handlers
+class JobCounters(SeededCounters):
+    def __init__(self):
+        super().__init__()
+        self.by_status = Counter()
+        self.jobs = {}  # job id -> status
+
+    async def fetch(self):
+        return await fetch_all("jobs", "id,status,created_at")
+
+    def rebuild(self, rows):
+        self.by_status = Counter()
+        self.jobs = {}
+        for row in rows:
+            self.added(row)
+
+    @counter_update
+    def added(self, row):
+        if row["id"] in self.jobs:
+            return self.updated(row)
+        self.jobs[row["id"]] = row.get("status")
+        self.by_status[row.get("status")] += 1
+
+    @counter_update
+    def removed(self, row):
+        if row["id"] in self.jobs:
+            decrement(self.by_status, self.jobs.pop(row["id"]))
+
+    @counter_update
+    def updated(self, row):
+        if row["id"] not in self.jobs:
+            return self.added(row)
+        if "status" in row and row["status"] != self.jobs[row["id"]]:
+            self.removed(row)
+            self.added(row)
+
+    def counts(self):
+        return {"total": len(self.jobs), "by_status": dict(self.by_status)}
+
+
+application_counters = ApplicationCounters()
+job_counters = JobCounters()
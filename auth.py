@@ -1,43 +1,210 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from supabase import create_client
+from supabase_client import get_supabase, get_http_client
+from types import SimpleNamespace
+import hashlib
+import httpx
+import jwt
 import os
-from dotenv import load_dotenv
+from cache_utils import TTLCache, MISSING
 # Create Bearer token reader
 security = HTTPBearer()
 
-load_dotenv()
+# Token verification mode: "local" checks signature and expiry here, "remote" asks supabase every time
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local")
+# Legacy HS256 projects sign tokens with this secret, otherwise the JWKS of the project is used
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
 
-# Create Supabase client
-supabase = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+# Verified users keyed by sha256 of the token, an entry never outlives the token exp
+token_cache = TTLCache(
+    maxsize=int(os.getenv("AUTH_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", "300")),
 )
+# How tokens were verified when they were not in the cache
+verify_counts = {"local": 0, "remote": 0}
+
+# Signing keys (PyJWK) of the project by kid, tokens with an unknown kid go to the remote check
+jwks_keys = {}
+
+
+# Load the verification keys once, called from the app startup
+async def load_jwt_keys():
+    global jwks_keys
+    if SUPABASE_JWT_SECRET or AUTH_VERIFY_MODE != "local":
+        return
+    try:
+        response = await get_http_client().get(
+            f"{os.getenv('SUPABASE_URL')}/auth/v1/.well-known/jwks.json",
+            headers={"apikey": os.getenv("SUPABASE_SERVICE_ROLE_KEY")},
+        )
+        response.raise_for_status()
+        jwk_set = jwt.PyJWKSet.from_dict(response.json())
+        jwks_keys = {key.key_id: key for key in jwk_set.keys}
+    except Exception as e:
+        # no keys means every token goes to the remote check
+        print(f"Could not load JWKS, falling back to remote token check: {e}")
+        jwks_keys = {}
+
+
+# Verify the token signature and expiry without a network call
+# Returns None when there is no key for this token so the caller can fall back to supabase
+def verify_token_locally(token):
+    header = jwt.get_unverified_header(token)
+    alg = header.get("alg")
+    if alg == "HS256" and SUPABASE_JWT_SECRET:
+        key = SUPABASE_JWT_SECRET
+    elif alg in ("RS256", "ES256") and header.get("kid") in jwks_keys:
+        key = jwks_keys[header["kid"]]
+        # the key decides the algorithm, a token claiming another one is rejected
+        if alg != key.algorithm_name:
+            raise jwt.InvalidAlgorithmError("The token algorithm does not match its key")
+    else:
+        return None
+    return jwt.decode(
+        token, key, algorithms=[alg], audience=SUPABASE_JWT_AUDIENCE, options={"require": ["sub"]}
+    )
+
+
+# Build the same user.user.id shape that supabase.auth.get_user returns
+def user_from_claims(claims):
+    return SimpleNamespace(
+        user=SimpleNamespace(
+            id=claims["sub"],
+            email=claims.get("email"),
+            role=claims.get("role"),
+            app_metadata=claims.get("app_metadata", {}),
+            user_metadata=claims.get("user_metadata", {}),
+        )
+    )
+
+
+def token_cache_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
 
 #function to get Token verification from supabase
-def get_current_user(cred: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(cred: HTTPAuthorizationCredentials = Depends(security)):
     #extract token from header
     token = cred.credentials
-    #verify token with supabase
-    user = supabase.auth.get_user(token) #get user details from supabase
-    
+    cache_key = token_cache_key(token)
+    user = token_cache.get(cache_key)
+    if user is not MISSING:
+        return user
+
+    user = None
+    if AUTH_VERIFY_MODE == "local":
+        try:
+            claims = verify_token_locally(token)
+        except (jwt.PyJWTError, TypeError, ValueError):
+            # malformed header, wrong key type, missing sub... all mean a bad token
+            raise HTTPException(status_code=401, detail="invalid token")
+        if claims is not None:
+            verify_counts["local"] += 1
+            user = user_from_claims(claims)
+
+    if user is None:
+        #verify token with supabase
+        verify_counts["remote"] += 1
+        try:
+            user = await get_supabase().auth.get_user(token) #get user details from supabase
+        except HTTPException:
+            # open circuit / full bulkhead of supabase_auth (503)
+            raise
+        except Exception as e:
+            # the supabase sdk is imported by the clients container on first use, not here
+            from supabase_auth.errors import AuthApiError, AuthRetryableError
+            # only a rejected token is a 401, an auth outage must not log users out
+            if isinstance(e, AuthApiError) and e.status in (401, 403):
+                user = None
+            elif isinstance(e, (AuthRetryableError, httpx.TransportError)) or getattr(e, "status", 0) >= 500:
+                raise HTTPException(status_code=503, detail="Authentication service unavailable, try again later")
+            else:
+                raise
+
     #chk invalid token
     if user is None:
         raise HTTPException(status_code=401, detail="invalid token")
 
+    try:
+        expires_at = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.InvalidTokenError:
+        expires_at = None
+    token_cache.set(cache_key, user, expires_at=expires_at)
     return user
 
+
+# Roles keyed by user id, None is cached too so users without a role don't hit the db every time
+role_cache = TTLCache(
+    maxsize=int(os.getenv("ROLE_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("ROLE_CACHE_TTL", "60")),
+)
+
+
+# Get the role of one user ("admin", "subadmin", "user" or None)
+async def get_user_role(user_id):
+    role = role_cache.get(user_id)
+    if role is not MISSING:
+        return role
+    role_data = await get_supabase().table("user_roles").select("role").eq("user_id", user_id).execute()
+    role = role_data.data[0]["role"] if role_data.data else None
+    role_cache.set(user_id, role)
+    return role
+
+
+# Get roles of many users with at most one query, returns {user_id: role}
+async def get_user_roles(user_ids):
+    roles = {}
+    missing = []
+    for user_id in set(user_ids):
+        role = role_cache.get(user_id)
+        if role is MISSING:
+            missing.append(user_id)
+        else:
+            roles[user_id] = role
+    if missing:
+        role_data = await get_supabase().table("user_roles").select("user_id, role").in_("user_id", missing).execute()
+        found = {row["user_id"]: row["role"] for row in role_data.data}
+        for user_id in missing:
+            roles[user_id] = found.get(user_id)
+            role_cache.set(user_id, roles[user_id])
+    return roles
+
+
+# Write the role to the table and the cache together
+async def set_user_role(user_id, role):
+    await get_supabase().table("user_roles").upsert({"user_id": user_id, "role": role}).execute()
+    role_cache.set(user_id, role)
+    return role
+
+
+# Drop one user (or everyone) from the role cache, e.g. after a role was changed in the dashboard
+def invalidate_user_role(user_id=None):
+    if user_id is None:
+        role_cache.clear()
+    else:
+        role_cache.invalidate(user_id)
+
+
+# Cache counters so we can see how many requests skipped token verification
+def auth_cache_stats():
+    return {
+        "mode": AUTH_VERIFY_MODE,
+        "verified": dict(verify_counts),
+        "tokens": token_cache.stats(),
+        "roles": role_cache.stats(),
+    }
+
+
 #Make Function for Role check
-def check_admin_or_subadmin(user):# It gets user return from get_current_user function
-    #Fetch user role from user_roles table
-    role_data = supabase.table("user_roles").select("role").eq("user_id", user.user.id).execute()
-    #if no role is found 
-    if not role_data.data:
+async def check_admin_or_subadmin(user):# It gets user return from get_current_user function
+    #Fetch user role from the role cache / user_roles table
+    role = await get_user_role(user.user.id)
+    #if no role is found
+    if role is None:
         raise HTTPException(status_code=403, detail="Role not found")
-    # Get the role
-    role = role_data.data[0]['role']
     #Role check for admin and subadmin
-    if role_data.data[0]['role'] not in ['admin', 'subadmin']:
+    if role not in ['admin', 'subadmin']:
         raise HTTPException(status_code=403, detail="Access forbidden: Admins and Subadmins only")
 
     return role
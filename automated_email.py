@@ -1,75 +1,135 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import HTTPBearer
-from supabase import create_client
-import os
-from dotenv import load_dotenv
+from supabase_client import get_supabase
+from email_outbox import outbox
+from email_templates import template_cache
+from application_stats import application_counters
 from auth import get_current_user, check_admin_or_subadmin
-import smtplib
 from fastapi import Body
-from email.mime.text import MIMEText
+import anyio.to_thread
 
-load_dotenv()
-
-#smtp server configuration
-smtp_host = "smtp.gmail.com"
-smtp_port = 465
-smtp_email = os.getenv("SMTP_EMAIL")
-smtp_password = os.getenv("SMTP_PASSWORD")
 #Routing for email operations
 email_router = APIRouter(prefix="/emails", tags=["emails"])
 
-supabase = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-)
-
-app =FastAPI()
-#Create send email function
-def send_email(to_email, subject, body):
+# Most application ids one bulk status change can take
+BULK_STATUS_MAX = 200
+#Queue an email, the outbox worker sends it in the background (see email_outbox.py).
+#The outbox is sqlite, written on a worker thread so a busy file never blocks the event loop
+async def send_email(to_email, subject, body):
     try:
-        print("smtpemail", smtp_email, smtp_password)
-        msg = MIMEText(body)
-        msg["Subject"] = subject
-        msg["From"] = smtp_email
-        msg["To"] = to_email
-        
-        print("debug 1 - creating SMTP connection with 465")
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            print("debug 2 - SMTP connection created")
-            server.login(smtp_email, smtp_password)
-            print("debug 4 - login successful, sending email")
-            server.sendmail(smtp_email, to_email, msg.as_string())
-            print("debug 5 - email sent successfully")
+        return await anyio.to_thread.run_sync(outbox.enqueue, to_email, subject, body)
     except Exception as e:
         print(f"ERROR in send_email: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Email sending failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Email queueing failed: {str(e)}")
+
+# Values for the {placeholders} in email templates
+def template_values(application, status):
+    return {
+        "applicant_name": application.get("applicant_name"),
+        "job_title": application.get("title"),
+        "user_email": application.get("user_email"),
+        "status": status,
+    }
 
 #Automated email sending
 @email_router.patch("/applications/{app_id}/status")
-def update_application_status(app_id, data: dict = Body(...), user=Depends(get_current_user)):
+async def update_application_status(app_id, data: dict = Body(...), user=Depends(get_current_user)):
     try:
-        print("start")
-        check_admin_or_subadmin(user)
-        print("admin checked")
+        await check_admin_or_subadmin(user)
+        supabase = get_supabase()
         status = data["status"]
-        print("status saved")
-        supabase.table("applications").update({"status": status}).eq("id", app_id).execute()
-        print("updating the status")
-        app_data = supabase.table("applications").select("user_email").eq("id", app_id).single().execute()
-        print("getting useremail")
-        template = supabase.table("email_templates").select("subject", "body").eq("status", status).single().execute()
-        print("getting the template")
-        send_email(
-            app_data.data["user_email"],
-            template.data["subject"],
-            template.data["body"]
-        )
-        print("After getting template send email", send_email)
+        # compiled template from the in-memory cache, checked first so nothing is updated
+        # without its email
+        template = await template_cache.get(status)
+        if template is None:
+            raise HTTPException(status_code=404, detail=f"No email template for status {status}")
+        # the update returns the row, so no extra select for the applicant
+        response = await supabase.table("applications").update({"status": status}).eq("id", app_id).execute()
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Application not found")
+        application = response.data[0]
+        application_counters.updated(application)
+        subject, body = template.render(template_values(application, status))
+        await send_email(application["user_email"], subject, body)
         
-        return {"message": "status updated and email sent"}
+        return {"message": "status updated and email queued"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating application status: {str(e)}")
+
+
+# Outbox counters: queued, failed and sent emails
+@email_router.get("/outbox")
+async def outbox_status(user=Depends(get_current_user)):
+    await check_admin_or_subadmin(user)
+    return await anyio.to_thread.run_sync(outbox.stats)
+
+
+# Bulk status change: one update for all ids, one template render per applicant, one outbox batch
+@email_router.patch("/applications/status")
+async def bulk_update_application_status(data: dict = Body(...), user=Depends(get_current_user)):
+    try:
+        await check_admin_or_subadmin(user)
+        status = data["status"]
+        app_ids = list(dict.fromkeys(data["app_ids"]))  # drop duplicates, keep order
+        if not app_ids:
+            raise HTTPException(status_code=400, detail="No application ids given")
+        if len(app_ids) > BULK_STATUS_MAX:
+            raise HTTPException(status_code=400, detail=f"At most {BULK_STATUS_MAX} applications per request")
+        # check the template first so nothing is updated without its email
+        template = await template_cache.get(status)
+        if template is None:
+            raise HTTPException(status_code=404, detail=f"No email template for status {status}")
+
+        response = await get_supabase().table("applications").update({"status": status}).in_("id", app_ids).execute()
+        updated = {row["id"]: row for row in response.data}
+        for row in response.data:
+            application_counters.updated(row)
+
+        messages = []
+        for app_id in app_ids:
+            if app_id in updated:
+                subject, body = template.render(template_values(updated[app_id], status))
+                messages.append((updated[app_id]["user_email"], subject, body))
+        try:
+            await anyio.to_thread.run_sync(outbox.enqueue_many, messages)
+            email_result = "queued"
+        except Exception as e:
+            print(f"ERROR in bulk email queueing: {str(e)}")
+            email_result = "failed"
+
+        results = [
+            {"id": app_id, "status": "updated", "email": email_result}
+            if app_id in updated
+            else {"id": app_id, "status": "not_found"}
+            for app_id in app_ids
+        ]
+        return {"updated": len(updated), "results": results}
     except HTTPException:
         raise
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Missing field: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating application status: {str(e)}")
 
-     
\ No newline at end of file
+
+# Create or change a template, the cache is updated with it
+@email_router.put("/templates/{status}")
+async def save_template(status: str, data: dict = Body(...), user=Depends(get_current_user)):
+    try:
+        await check_admin_or_subadmin(user)
+        await template_cache.save(status, data["subject"], data["body"])
+        return {"message": "Template saved"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving template: {str(e)}")
+
+
+# Reload all templates, e.g. after editing them in the supabase dashboard
+@email_router.post("/templates/reload")
+async def reload_templates(user=Depends(get_current_user)):
+    await check_admin_or_subadmin(user)
+    await template_cache.load()
+    return {"message": "Templates reloaded", "count": len(template_cache.templates)}
@@ -0,0 +1,109 @@
+# Query latency of the in-memory blog search index at 10k and 100k posts
+#   python benchmarks/bench_blog_search.py [--sizes 10000 100000] [--queries 200]
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blog_search import BlogSearchIndex
+
+CATEGORIES = ["engineering", "design", "marketing", "careers", "news", "cloud", "security", "ai"]
+
+
+# Zipf-like vocabulary so a few words are common and most are rare, like real text
+def make_vocabulary(rng, size=20000):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    words = sorted(words)
+    # cumulative weights so random.choices doesn't rebuild them on every call
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(size)))
+    return words, weights
+
+
+def make_blogs(count, words, weights, rng):
+    blogs = []
+    for i in range(count):
+        content = rng.choices(words, cum_weights=weights, k=rng.randint(150, 400))
+        blogs.append(
+            {
+                "id": f"blog-{i}",
+                "title": " ".join(rng.choices(words, cum_weights=weights, k=rng.randint(4, 10))),
+                "content": "<p>" + " ".join(content) + "</p>",
+                "tags": rng.sample(words[:500], 3),
+                "category": rng.choice(CATEGORIES),
+                "author": "bench",
+                "thumbnail": None,
+                "created_at": f"2026-01-01T00:00:{i % 60:02d}+00:00",
+            }
+        )
+    return blogs
+
+
+def make_queries(words, weights, rng, count):
+    queries = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(rng.choice(words))  # one word
+        elif kind < 0.8:
+            queries.append(" ".join(rng.choices(words, cum_weights=weights, k=rng.randint(2, 3))))  # common words
+        else:
+            queries.append(rng.choice(words)[:3])  # prefix
+    return queries
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(size, queries_count, seed):
+    rng = random.Random(seed)
+    words, weights = make_vocabulary(rng)
+    blogs = make_blogs(size, words, weights, rng)
+
+    index = BlogSearchIndex()
+    start = time.perf_counter()
+    index.rebuild(blogs)
+    build_seconds = time.perf_counter() - start
+
+    timings = []
+    for query in make_queries(words, weights, rng, queries_count):
+        start = time.perf_counter()
+        index.search(query, limit=20)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # incremental writes as done by create_blog / update_blog / delete_blog
+    start = time.perf_counter()
+    for blog in make_blogs(200, words, weights, rng):
+        blog["id"] = "new-" + blog["id"]
+        index.add(blog)
+        index.remove(blog["id"])
+    write_ms = (time.perf_counter() - start) * 1000 / 400
+
+    print(
+        f"{size:>8} posts  build {build_seconds:6.2f}s  terms {len(index.terms):>7}  "
+        f"query p50 {statistics.median(timings):7.2f}ms  p95 {percentile(timings, 95):7.2f}ms  "
+        f"p99 {percentile(timings, 99):7.2f}ms  add/remove {write_ms:.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.queries, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Serialization time and response size of get_blogs and get_my_applications pages:
+# the old path (jsonable_encoder + json.dumps) against the response models, and the
+# size / cost of gzip and brotli on top
+#   python benchmarks/bench_serialization.py [--rows 50 200] [--repeat 200]
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from compression import BROTLI_QUALITY, GZIP_LEVEL, brotli
+from response_models import ApplicationPage, BlogPage
+
+WORDS = (
+    "fastapi supabase python request response cache latency database index query page "
+    "image upload worker async event loop json encoder token blog job applicant status"
+).split()
+
+
+# Shuffled words so the compression numbers are not flattered by repeated text
+def make_content(i, paragraphs=20):
+    rng = random.Random(i)
+    return "".join(
+        "<p>" + " ".join(rng.choice(WORDS) for _ in range(40)) + ".</p>" for _ in range(paragraphs)
+    )
+
+
+def make_blog(i):
+    return {
+        "id": str(uuid.UUID(int=i)),
+        "title": f"How we made page {i} faster",
+        "content": make_content(i),
+        "thumbnail": f"https://res.cloudinary.com/demo/image/upload/v1/blog{i}.webp",
+        "thumbnail_variants": {"thumb": f"https://cdn/{i}-t.webp", "card": f"https://cdn/{i}-c.webp"},
+        "internal_urls": [f"https://res.cloudinary.com/demo/image/upload/v1/inline{i}-{k}.webp" for k in range(3)],
+        "internal_variants": None,
+        "author": "Mehdi Tech",
+        "tags": ["python", "fastapi", "performance"],
+        "category": "engineering",
+        "created_by": str(uuid.UUID(int=10**6 + i)),
+        "created_at": f"2026-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}.123456+00:00",
+    }
+
+
+def make_application(i):
+    return {
+        "id": str(uuid.UUID(int=i)),
+        "applicant_name": f"Applicant {i}",
+        "user_email": f"applicant{i}@example.com",
+        "status": "Applied",
+        "jobs": {"title": "Backend Engineer"},
+        "phone_number": "+92 300 1234567",
+        "created_at": f"2026-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}.123456+00:00",
+    }
+
+
+# What FastAPI did for a route without a response model
+def encode_before(payload):
+    return json.dumps(
+        jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode()
+
+
+# What the routes do now: validate into the response model, dump JSON in pydantic-core
+def encoder_after(model):
+    adapter = TypeAdapter(model)
+
+    def encode(payload):
+        return adapter.dump_json(adapter.validate_python(payload), exclude_unset=True)
+
+    return encode
+
+
+def timed(function, argument, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(argument)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def report(name, payload, model, repeat):
+    before_ms, before = timed(encode_before, payload, repeat)
+    after_ms, after = timed(encoder_after(model), payload, repeat)
+    assert json.loads(before) == json.loads(after), "response models changed the payload"
+    gzip_ms, gzipped = timed(lambda body: gzip.compress(body, GZIP_LEVEL), after, repeat)
+    print(
+        f"{name:<28} encode {before_ms:7.3f}ms -> {after_ms:7.3f}ms ({before_ms / after_ms:4.1f}x)  "
+        f"bytes {len(after):>8} gzip {len(gzipped):>7} ({gzip_ms:.3f}ms)",
+        end="",
+    )
+    if brotli is not None:
+        brotli_ms, compressed = timed(lambda body: brotli.compress(body, quality=BROTLI_QUALITY), after, repeat)
+        print(f" br {len(compressed):>7} ({brotli_ms:.3f}ms)")
+    else:
+        print("  (brotli not installed)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    for rows in args.rows:
+        blogs = {"blogs": [make_blog(i) for i in range(rows)], "next_cursor": "WyIyMDI2Il0"}
+        report(f"get_blogs ({rows} rows)", blogs, BlogPage, args.repeat)
+        applications = {"applications": [make_application(i) for i in range(rows)], "next_cursor": "WyIyMDI2Il0"}
+        report(f"get_my_applications ({rows})", applications, ApplicationPage, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
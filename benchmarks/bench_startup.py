@@ -0,0 +1,102 @@
+# Cold start of the app, measured in fresh processes:
+#   import    python -c "import main"
+#   ready     from starting uvicorn until the port answers (GET /metrics)
+#   first     latency of the first GET /blogs after that, which needs supabase
+# The app runs against the local fakes (fakes.py). --app-dir compares another checkout,
+# e.g. git worktree add /tmp/before HEAD~1 && python benchmarks/bench_startup.py --app-dir /tmp/before
+#   python benchmarks/bench_startup.py [--runs 5] [--latency 0.02]
+import argparse
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import free_port, serve_in_process
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SCRIPT = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import main\n"
+    "elapsed = time.perf_counter() - start\n"
+    "heavy = [name for name in ('supabase', 'cloudinary', 'PIL') if name in sys.modules]\n"
+    "print(elapsed, ','.join(heavy))\n"
+)
+
+
+def time_import(app_dir, env):
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT], cwd=app_dir, env=env, capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(output[0]), output[1] if len(output) > 1 else "-"
+
+
+def time_boot(app_dir, env):
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=app_dir, env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"app exited with code {process.returncode}")
+                try:
+                    client.get("/metrics")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.005)
+            ready = time.perf_counter() - start
+            first_start = time.perf_counter()
+            response = client.get("/blogs", params={"limit": 20})
+            response.raise_for_status()
+            first = time.perf_counter() - first_start
+        return ready, first
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every supabase call")
+    parser.add_argument("--app-dir", default=ROOT)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        conn, child_conn = multiprocessing.Pipe()
+        fakes = multiprocessing.Process(
+            target=serve_in_process, args=(child_conn, workdir, args.latency, 0.0, None, None, {}), daemon=True
+        )
+        fakes.start()
+        env = {**os.environ, **conn.recv()}
+        imports, readies, firsts = [], [], []
+        heavy = "-"
+        for _ in range(args.runs):
+            seconds, heavy = time_import(args.app_dir, env)
+            imports.append(seconds)
+            ready, first = time_boot(args.app_dir, env)
+            readies.append(ready)
+            firsts.append(first)
+        conn.send("stop")
+        conn.recv()
+        fakes.join(10)
+
+    print(f"app: {args.app_dir}  runs: {args.runs}  supabase latency: {args.latency}s")
+    for name, values in (("import main", imports), ("boot until ready", readies), ("first GET /blogs", firsts)):
+        print(f"{name:<18} median {statistics.median(values) * 1000:8.1f}ms  min {min(values) * 1000:8.1f}ms")
+    print(f"SDKs loaded by the import: {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import asyncio
+import random
+import uuid
+
+from starlette.applications import Starlette
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+# Answers the upload, destroy and resources-by-id calls of the cloudinary SDK.
+# Point the SDK at it with cloudinary.config(upload_prefix="http://127.0.0.1:<port>")
+class FakeCloudinary:
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.assets = {}  # public_id -> size in bytes
+        self.requests = 0
+        self.app = Starlette(routes=[
+            Route("/v1_1/{cloud}/image/upload", self.upload, methods=["POST"]),
+            Route("/v1_1/{cloud}/image/destroy", self.destroy, methods=["POST"]),
+            Route("/v1_1/{cloud}/resources/image/upload", self.resources, methods=["GET"]),
+        ])
+
+    async def delay(self):
+        self.requests += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+    async def upload(self, request: Request):
+        await self.delay()
+        try:
+            form = await request.form()
+        except ClientDisconnect:
+            # the app gave up waiting (timeout)
+            return Response(status_code=499)
+        upload = form.get("file")
+        size = len(await upload.read()) if hasattr(upload, "read") else len(upload or "")
+        public_id = uuid.uuid4().hex
+        self.assets[public_id] = size
+        cloud = request.path_params["cloud"]
+        return JSONResponse({
+            "public_id": public_id,
+            "bytes": size,
+            "secure_url": f"https://res.cloudinary.test/{cloud}/image/upload/{public_id}",
+            "url": f"http://res.cloudinary.test/{cloud}/image/upload/{public_id}",
+        })
+
+    async def destroy(self, request: Request):
+        await self.delay()
+        form = await request.form()
+        found = self.assets.pop(form.get("public_id"), None) is not None
+        return JSONResponse({"result": "ok" if found else "not found"})
+
+    async def resources(self, request: Request):
+        await self.delay()
+        ids = request.query_params.getlist("public_ids[]") or request.query_params.getlist("public_ids")
+        return JSONResponse({"resources": [{"public_id": public_id} for public_id in ids if public_id in self.assets]})
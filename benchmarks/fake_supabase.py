@@ -0,0 +1,349 @@
+import asyncio
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+
+import jwt
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+# In-memory stand-in for the parts of PostgREST, Storage and Auth that the routers use.
+# Every request waits latency + uniform(0, jitter) seconds before it is answered
+class FakeSupabase:
+    def __init__(self, jwt_secret="bench-secret", latency=0.0, jitter=0.0):
+        self.jwt_secret = jwt_secret
+        self.latency = latency
+        self.jitter = jitter
+        self.tables = {
+            "user_roles": [],
+            "blogs": [],
+            "jobs": [],
+            "applications": [],
+            "email_templates": [],
+            "deleted_rows": [],
+        }
+        # updated_at is set on insert and by an update trigger in the real schema
+        self.updated_at_tables = {"blogs", "jobs", "applications"}
+        # table -> (column, referenced table) for embedded selects like jobs(title)
+        self.foreign_keys = {"applications": {"jobs": "job_id"}}
+        self.unique = {"applications": [("job_id", "user_email")], "user_roles": [("user_id",)], "email_templates": [("status",)]}
+        self.primary_keys = {"user_roles": "user_id", "email_templates": "status"}
+        self.objects = {}
+        self.users = {}
+        self.requests = 0
+        self.app = Starlette(routes=[
+            Route("/rest/v1/{table}", self.rest, methods=["GET", "POST", "PATCH", "DELETE", "HEAD"]),
+            Route("/storage/v1/object/public/{bucket}/{path:path}", self.storage_get, methods=["GET"]),
+            Route("/storage/v1/object/{bucket}/{path:path}", self.storage_put, methods=["POST", "PUT"]),
+            Route("/storage/v1/object/{bucket}", self.storage_delete, methods=["DELETE"]),
+            Route("/auth/v1/.well-known/jwks.json", self.jwks, methods=["GET"]),
+            Route("/auth/v1/user", self.auth_user, methods=["GET"]),
+            Route("/auth/v1/token", self.auth_token, methods=["POST"]),
+            Route("/auth/v1/signup", self.auth_signup, methods=["POST"]),
+        ])
+
+    # ---------- helpers ----------
+    def now(self):
+        return datetime.now(timezone.utc).isoformat()
+
+    def make_token(self, user_id, email="user@example.com", ttl=3600):
+        return jwt.encode(
+            {"sub": user_id, "email": email, "aud": "authenticated", "role": "authenticated",
+             "exp": int(time.time()) + ttl},
+            self.jwt_secret, algorithm="HS256",
+        )
+
+    async def delay(self):
+        self.requests += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+    # ---------- PostgREST ----------
+    @staticmethod
+    def coerce(raw, sample):
+        if raw == "null":
+            return None
+        if isinstance(sample, bool):
+            return raw == "true"
+        if isinstance(sample, int):
+            try:
+                return int(raw)
+            except ValueError:
+                return raw
+        if isinstance(sample, float):
+            return float(raw)
+        if raw.startswith('"') and raw.endswith('"'):
+            return raw[1:-1]
+        return raw
+
+    @staticmethod
+    def split_top(text, sep=","):
+        parts, depth, current, quoted = [], 0, "", False
+        for ch in text:
+            if ch == '"':
+                quoted = not quoted
+            if not quoted and ch == "(":
+                depth += 1
+            elif not quoted and ch == ")":
+                depth -= 1
+            if ch == sep and depth == 0 and not quoted:
+                parts.append(current)
+                current = ""
+            else:
+                current += ch
+        if current:
+            parts.append(current)
+        return parts
+
+    def compare(self, row, column, expr):
+        negate = False
+        if expr.startswith("not."):
+            negate, expr = True, expr[4:]
+        op, _, raw = expr.partition(".")
+        value = row.get(column)
+        if op == "in":
+            items = [self.coerce(v.strip(), value) for v in self.split_top(raw.strip("()"))]
+            result = value in items
+        elif op == "is":
+            result = value is None if raw == "null" else value == (raw == "true")
+        elif op == "cs":
+            items = [v.strip('"') for v in self.split_top(raw.strip("{}"))]
+            result = value is not None and all(item in value for item in items)
+        elif op == "ov":
+            items = [v.strip('"') for v in self.split_top(raw.strip("{}"))]
+            result = value is not None and any(item in value for item in items)
+        else:
+            target = self.coerce(raw, value)
+            if value is None:
+                result = op == "neq" and target is not None
+            elif op == "eq":
+                result = value == target
+            elif op == "neq":
+                result = value != target
+            elif op == "lt":
+                result = value < target
+            elif op == "lte":
+                result = value <= target
+            elif op == "gt":
+                result = value > target
+            elif op == "gte":
+                result = value >= target
+            elif op in ("like", "ilike"):
+                pattern = re.escape(raw).replace("\\*", ".*").replace("%", ".*")
+                result = re.fullmatch(pattern, str(value), re.I if op == "ilike" else 0) is not None
+            else:
+                raise ValueError(f"unsupported operator {op}")
+        return not result if negate else result
+
+    def match_logic(self, row, op, body):
+        conditions = self.split_top(body[1:-1])
+        results = []
+        for cond in conditions:
+            if cond.startswith("and(") or cond.startswith("or("):
+                name, _, rest = cond.partition("(")
+                results.append(self.match_logic(row, name, "(" + rest))
+            else:
+                column, _, expr = cond.partition(".")
+                results.append(self.compare(row, column, expr))
+        return all(results) if op == "and" else any(results)
+
+    def filter_rows(self, rows, params):
+        reserved = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+        for key, value in params:
+            if key in reserved:
+                continue
+            if key in ("or", "and"):
+                rows = [row for row in rows if self.match_logic(row, key, value)]
+            else:
+                rows = [row for row in rows if self.compare(row, key, value)]
+        return rows
+
+    def project(self, table, row, select):
+        if not select or select == "*":
+            return dict(row)
+        result = {}
+        for field in self.split_top(select.replace(" ", "")):
+            if "(" in field:
+                name, _, cols = field.partition("(")
+                name = name.split(":")[-1].split("!")[0]
+                fk = self.foreign_keys.get(table, {}).get(name)
+                related = next((r for r in self.tables.get(name, []) if r.get("id") == row.get(fk)), None)
+                result[name] = self.project(name, related, cols[:-1]) if related else None
+            elif field == "*":
+                result.update(row)
+            else:
+                result[field] = row.get(field)
+        return result
+
+    def order_rows(self, rows, order):
+        for part in reversed(order.split(",")):
+            column, *mods = part.split(".")
+            desc = "desc" in mods
+            rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        return rows
+
+    def error(self, status, code, message):
+        return JSONResponse({"code": code, "message": message, "details": None, "hint": None}, status_code=status)
+
+    def check_constraints(self, table, row, ignore=None):
+        for columns in self.unique.get(table, []):
+            for other in self.tables[table]:
+                if other is ignore:
+                    continue
+                if all(other.get(c) == row.get(c) for c in columns):
+                    return self.error(409, "23505", f"duplicate key value violates unique constraint on {table}")
+        for name, fk in self.foreign_keys.get(table, {}).items():
+            if row.get(fk) is not None and not any(r.get("id") == row.get(fk) for r in self.tables[name]):
+                return self.error(409, "23503", f"insert or update on table {table} violates foreign key constraint")
+        return None
+
+    def respond(self, request, table, rows, total=None, status=200):
+        prefer = request.headers.get("prefer", "")
+        accept = request.headers.get("accept", "")
+        params = request.query_params
+        if request.method in ("POST", "PATCH", "DELETE") and "return=representation" not in prefer:
+            return Response(status_code=204 if request.method != "POST" else 201)
+        body = [self.project(table, row, params.get("select")) for row in rows]
+        headers = {}
+        if "count=exact" in prefer:
+            count = total if total is not None else len(rows)
+            headers["content-range"] = f"0-{max(len(body) - 1, 0)}/{count}" if body else f"*/{count}"
+        if "vnd.pgrst.object" in accept:
+            if len(body) != 1:
+                return self.error(406, "PGRST116", "JSON object requested, multiple (or no) rows returned")
+            return JSONResponse(body[0], status_code=status, headers=headers)
+        if request.method == "HEAD":
+            return Response(status_code=200, headers=headers)
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    async def rest(self, request: Request):
+        await self.delay()
+        table = request.path_params["table"]
+        if table not in self.tables:
+            return self.error(404, "42P01", f"relation {table} does not exist")
+        params = list(request.query_params.multi_items())
+        rows = self.tables[table]
+        if request.method in ("GET", "HEAD"):
+            rows = self.filter_rows(rows, params)
+            total = len(rows)
+            if request.query_params.get("order"):
+                rows = self.order_rows(rows, request.query_params["order"])
+            offset = int(request.query_params.get("offset", 0))
+            if request.query_params.get("limit"):
+                rows = rows[offset:offset + int(request.query_params["limit"])]
+            else:
+                rows = rows[offset:]
+            return self.respond(request, table, rows, total=total)
+        if request.method == "POST":
+            payload = await request.json()
+            payload = payload if isinstance(payload, list) else [payload]
+            upsert = "merge-duplicates" in request.headers.get("prefer", "")
+            created = []
+            for item in payload:
+                row = dict(item)
+                pk = self.primary_keys.get(table, "id")
+                if upsert:
+                    existing = next((r for r in self.tables[table] if r.get(pk) == row.get(pk)), None)
+                    if existing is not None:
+                        existing.update(row)
+                        created.append(existing)
+                        continue
+                row.setdefault("id", str(uuid.uuid4()))
+                row.setdefault("created_at", self.now())
+                if table in self.updated_at_tables:
+                    row.setdefault("updated_at", row["created_at"])
+                if table == "deleted_rows":
+                    row.setdefault("deleted_at", row["created_at"])
+                failure = self.check_constraints(table, row)
+                if failure is not None:
+                    return failure
+                self.tables[table].append(row)
+                created.append(row)
+            return self.respond(request, table, created, status=201)
+        if request.method == "PATCH":
+            changes = await request.json()
+            matched = self.filter_rows(rows, params)
+            for row in matched:
+                candidate = {**row, **changes}
+                failure = self.check_constraints(table, candidate, ignore=row)
+                if failure is not None:
+                    return failure
+                row.update(changes)
+                if table in self.updated_at_tables:
+                    row["updated_at"] = self.now()
+            return self.respond(request, table, matched)
+        if request.method == "DELETE":
+            matched = self.filter_rows(rows, params)
+            ids = {id(row) for row in matched}
+            self.tables[table] = [row for row in rows if id(row) not in ids]
+            return self.respond(request, table, matched)
+
+    # ---------- Storage ----------
+    async def storage_put(self, request: Request):
+        await self.delay()
+        key = f"{request.path_params['bucket']}/{request.path_params['path']}"
+        size = 0
+        chunks = []
+        async for chunk in request.stream():
+            size += len(chunk)
+            chunks.append(chunk)
+        self.objects[key] = b"".join(chunks)
+        return JSONResponse({"Key": key, "Id": str(uuid.uuid4())})
+
+    async def storage_get(self, request: Request):
+        key = f"{request.path_params['bucket']}/{request.path_params['path']}"
+        if key not in self.objects:
+            return JSONResponse({"error": "not found"}, status_code=404)
+        return Response(self.objects[key], media_type="application/pdf")
+
+    async def storage_delete(self, request: Request):
+        await self.delay()
+        payload = await request.json()
+        bucket = request.path_params["bucket"]
+        removed = []
+        for prefix in payload.get("prefixes", []):
+            if self.objects.pop(f"{bucket}/{prefix}", None) is not None:
+                removed.append({"name": prefix})
+        return JSONResponse(removed)
+
+    # ---------- Auth ----------
+    async def jwks(self, request: Request):
+        return JSONResponse({"keys": []})
+
+    def user_json(self, user_id, email):
+        return {"id": user_id, "aud": "authenticated", "role": "authenticated", "email": email,
+                "app_metadata": {}, "user_metadata": {}, "created_at": "2024-01-01T00:00:00Z"}
+
+    async def auth_user(self, request: Request):
+        await self.delay()
+        token = request.headers.get("authorization", "").removeprefix("Bearer ")
+        try:
+            claims = jwt.decode(token, self.jwt_secret, algorithms=["HS256"], audience="authenticated")
+        except jwt.InvalidTokenError:
+            return JSONResponse({"code": 401, "error_code": "bad_jwt", "msg": "invalid JWT"}, status_code=401)
+        return JSONResponse(self.user_json(claims["sub"], claims.get("email")))
+
+    async def auth_signup(self, request: Request):
+        await self.delay()
+        payload = await request.json()
+        user_id = str(uuid.uuid4())
+        self.users[payload["email"]] = (user_id, payload["password"])
+        return JSONResponse(self.user_json(user_id, payload["email"]))
+
+    async def auth_token(self, request: Request):
+        await self.delay()
+        payload = await request.json()
+        user = self.users.get(payload.get("email"))
+        if user is None or user[1] != payload.get("password"):
+            return JSONResponse({"code": 400, "error_code": "invalid_credentials", "msg": "Invalid login credentials"}, status_code=400)
+        token = self.make_token(user[0], payload["email"])
+        return JSONResponse({
+            "access_token": token, "token_type": "bearer", "expires_in": 3600,
+            "expires_at": int(time.time()) + 3600, "refresh_token": "r",
+            "user": self.user_json(user[0], payload["email"]),
+        })
@@ -0,0 +1,223 @@
+# Fault injection against the local fakes. The app runs as in load_test.py, and public
+# reads keep going while one dependency is made slow or failing (faults.py). Each scenario
+# checks three things:
+#   isolated   reads that don't need the faulty dependency keep their latency and succeed
+#   bounded    calls that do need it end within their timeout budget, and once its
+#              circuit is open they fail fast with 503 instead of waiting
+#   recovered  after the fault is gone the circuit closes again and the calls succeed
+# The app gets small timeouts and breaker settings (SETTINGS) so a run takes about a minute.
+#   python benchmarks/fault_injection.py [--scenario slow_smtp] [--duration 8]
+# Exits with 1 when a check fails
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_supabase import FakeSupabase
+from fakes import ADMIN_ID, JWT_SECRET, free_port, seed, serve_in_process
+from load_test import Traffic, client_loop, percentile, start_app
+
+DEPENDENCIES = ("supabase_rest", "supabase_auth", "supabase_storage", "cloudinary", "smtp")
+SETTINGS = {
+    "SUPABASE_TIMEOUT": "1",
+    "SUPABASE_STORAGE_TIMEOUT": "2",
+    "CLOUDINARY_TIMEOUT": "2",
+    "CLOUDINARY_CONCURRENCY": "4",
+    "CLOUDINARY_BULKHEAD_WAIT": "1",
+    "SMTP_TIMEOUT": "1",
+    "EMAIL_RETRY_BASE_SECONDS": "1",
+    # keep the blog reads going to supabase instead of the read cache
+    "BLOG_CACHE_TTL": "0.5",
+    **{f"{name.upper()}_BREAKER_FAILURES": "3" for name in DEPENDENCIES},
+    **{f"{name.upper()}_BREAKER_RESET": "3" for name in DEPENDENCIES},
+}
+READS = {"GET /blogs/{blog_id}": 1, "GET /jobs/jobs/{job_id}": 1}
+
+# name -> fault (target, settings for FakeServers.inject), traffic that needs the faulty
+# dependency, the dependency whose circuit should open, and the seconds one of those calls
+# may take at most while the fault lasts. Failing fast means the median 503 came back in
+# less than a quarter of the dependency's timeout
+SCENARIOS = {
+    "slow_smtp": (
+        ("smtp", {"latency": 10}),
+        {"PATCH /emails/applications/{app_id}/status": 1}, "smtp", 1.0,
+    ),
+    "slow_cloudinary": (
+        ("cloudinary", {"latency": 10}),
+        {"POST /blogs": 1}, "cloudinary", 6.0,
+    ),
+    "storage_errors": (
+        ("supabase", {"prefix": "/storage/", "error_rate": 1.0, "status": 500}),
+        {"POST /jobapply/job_apply/{job_id}": 1}, "supabase_storage", 3.0,
+    ),
+    "rest_outage": (
+        ("supabase", {"prefix": "/rest/", "latency": 5}),
+        {}, "supabase_rest", 3.0,
+    ),
+}
+
+
+class Harness:
+    def __init__(self, args, conn, tables, admin_token, base_url):
+        self.args = args
+        self.conn = conn
+        self.tables = tables
+        self.admin_token = admin_token
+        self.base_url = base_url
+        self.failed = []
+
+    def inject(self, target, **settings):
+        self.conn.send(("inject", target, settings))
+        self.conn.recv()
+
+    async def upstreams(self, client):
+        response = await client.get("/upstreams/stats", headers={"Authorization": f"Bearer {self.admin_token}"})
+        return response.json()
+
+    # Run `concurrency` clients per mix for `seconds`, returns {endpoint: [(latency, status)]}
+    async def traffic(self, client, mixes, seconds):
+        results = {}
+        start = time.perf_counter()
+        loops = [
+            client_loop(
+                Traffic(client, self.tables, self.admin_token, random.Random(self.args.seed + i)),
+                mix, start + seconds, start, results,
+            )
+            for mix in mixes if mix
+            for i in range(self.args.concurrency)
+        ]
+        await asyncio.gather(*loops)
+        return results
+
+    def check(self, scenario, name, ok, detail):
+        print(f"  {'PASS' if ok else 'FAIL'}  {name}: {detail}")
+        if not ok:
+            self.failed.append(f"{scenario}: {name}")
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=4 * self.args.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=30) as client:
+            baseline = await self.traffic(client, [READS], self.args.duration)
+            print("baseline")
+            report(baseline)
+            read_p95 = percentile(sorted(sample[0] for samples in baseline.values() for sample in samples), 0.95)
+            names = [self.args.scenario] if self.args.scenario else list(SCENARIOS)
+            for name in names:
+                await self.scenario(client, name, read_p95)
+        return not self.failed
+
+    async def scenario(self, client, name, read_p95):
+        (target, settings), mix, dependency, budget = SCENARIOS[name]
+        opened_before = (await self.upstreams(client))[dependency]["opened"]
+        self.inject(target, **settings)
+        try:
+            results = await self.traffic(client, [READS, mix], self.args.duration)
+            stats = (await self.upstreams(client))[dependency]
+        finally:
+            self.inject(target, prefix=settings.get("prefix", "/"))
+        print(f"{name}: {target} {settings}")
+        report(results)
+
+        reads = [sample for endpoint in READS for sample in results.get(endpoint, [])]
+        if dependency != "supabase_rest":
+            latencies = sorted(sample[0] for sample in reads)
+            errors = sum(1 for sample in reads if sample[1] != 200)
+            limit = max(3 * read_p95, read_p95 + 0.1)
+            self.check(
+                name, "isolated", errors == 0 and percentile(latencies, 0.95) <= limit,
+                f"reads p95 {percentile(latencies, 0.95) * 1000:.0f}ms (limit {limit * 1000:.0f}ms), {errors} errors",
+            )
+        if dependency == "supabase_rest":
+            faulty = reads
+        else:
+            faulty = [sample for endpoint in mix for sample in results.get(endpoint, [])]
+        slowest = max(sample[0] for sample in faulty)
+        fast_fails = sorted(sample[0] for sample in faulty if sample[1] == 503)
+        if dependency == "smtp":
+            # the outbox worker talks to smtp, requests only queue the email
+            detail = f"slowest status change {slowest:.2f}s, smtp circuit {stats['state']}"
+            self.check(name, "bounded", slowest <= budget and stats["opened"] > opened_before, detail)
+        else:
+            fail_fast = percentile(fast_fails, 0.5) if fast_fails else None
+            detail = (
+                f"slowest {slowest:.2f}s (budget {budget}s), {len(fast_fails)} failed with 503 "
+                f"(p50 {fail_fast * 1000 if fail_fast is not None else 0:.0f}ms), circuit opened "
+                f"{stats['opened'] - opened_before}x"
+            )
+            ok = (
+                slowest <= budget and stats["opened"] > opened_before
+                and fail_fast is not None and fail_fast < stats["timeout"] / 4
+            )
+            self.check(name, "bounded", ok, detail)
+
+        # the circuit lets a trial call through after the reset time, traffic provides it
+        reset = float(SETTINGS[f"{dependency.upper()}_BREAKER_RESET"])
+        await asyncio.sleep(reset)
+        recovery = await self.traffic(client, [READS, mix], 3)
+        stats = (await self.upstreams(client))[dependency]
+        tail = [
+            sample[1] for samples in recovery.values() for sample in samples[len(samples) // 2:]
+        ]
+        errors = sum(1 for status in tail if not 200 <= status < 400)
+        self.check(name, "recovered", stats["state"] == "closed" and errors == 0,
+                   f"circuit {stats['state']}, {errors} errors in the last {len(tail)} calls")
+
+
+def report(results):
+    print(f"  {'endpoint':<46}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}  statuses")
+    for endpoint, samples in sorted(results.items()):
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        statuses = {}
+        for sample in samples:
+            statuses[sample[1]] = statuses.get(sample[1], 0) + 1
+        print(
+            f"  {endpoint:<46}{len(samples):>7}{percentile(latencies, 0.5):>9.1f}{percentile(latencies, 0.95):>9.1f}"
+            f"{latencies[-1]:>9.1f}  {dict(sorted(statuses.items()))}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=8, help="seconds each fault lasts")
+    parser.add_argument("--concurrency", type=int, default=4, help="clients for the reads and for the faulty traffic")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds added to every supabase call")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # same seed as the fakes process, so the ids picked here exist there
+    local = FakeSupabase(JWT_SECRET)
+    seed(local)
+    admin_token = local.make_token(ADMIN_ID, "admin@example.com", 24 * 3600)
+    with tempfile.TemporaryDirectory() as workdir:
+        conn, child_conn = multiprocessing.Pipe()
+        fakes = multiprocessing.Process(
+            target=serve_in_process, args=(child_conn, workdir, args.latency, 0.0, 0.05, 0.01, {}), daemon=True
+        )
+        fakes.start()
+        env = {**conn.recv(), **SETTINGS}
+        port = free_port()
+        app = start_app(env, port, 1)
+        try:
+            harness = Harness(args, conn, local.tables, admin_token, f"http://127.0.0.1:{port}")
+            ok = asyncio.run(harness.run())
+        finally:
+            app.terminate()
+            app.wait(10)
+            conn.send("stop")
+            conn.recv()
+            fakes.join(10)
+    print("all checks passed" if ok else "failed: " + ", ".join(harness.failed))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
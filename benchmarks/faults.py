@@ -0,0 +1,38 @@
+import asyncio
+import json
+import random
+
+
+# ASGI middleware in front of a fake: requests whose path starts with a prefix get extra
+# latency, and error_rate of them are answered with `status` without reaching the fake.
+#   injector.set("/storage/", error_rate=1.0)   injector.set("/rest/", latency=30)   injector.clear()
+class FaultInjector:
+    def __init__(self, app):
+        self.app = app
+        self.rules = {}  # path prefix -> {"latency": s, "error_rate": f, "status": code}
+        self.injected = 0
+
+    def set(self, prefix="/", latency=0.0, error_rate=0.0, status=503):
+        self.rules[prefix] = {"latency": latency, "error_rate": error_rate, "status": status}
+
+    def clear(self):
+        self.rules.clear()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for prefix, rule in list(self.rules.items()):
+                if not scope["path"].startswith(prefix):
+                    continue
+                if rule["latency"]:
+                    await asyncio.sleep(rule["latency"])
+                if random.random() < rule["error_rate"]:
+                    self.injected += 1
+                    body = json.dumps({"message": "injected fault", "code": str(rule["status"])}).encode()
+                    await send({
+                        "type": "http.response.start",
+                        "status": rule["status"],
+                        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+        await self.app(scope, receive, send)
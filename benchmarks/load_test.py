@@ -0,0 +1,250 @@
+# Load test of main.app against the local fakes in fakes.py. The app runs in its own
+# uvicorn process (like on Railway), the fakes in a second one and the load generator in this one.
+# Each of --concurrency clients sends requests back to back, picking the endpoint by
+# the weights of the traffic mix, and the report has req/s and p50/p95/p99 per endpoint
+#   python benchmarks/load_test.py --mix mixed --duration 30 --concurrency 32 --latency 0.02
+# Mixes: public (blog and job reads), mixed (reads + job applications + admin status
+# changes), admin (dashboard work: application lists, status changes, new blogs)
+import argparse
+import asyncio
+import io
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_supabase import FakeSupabase
+from fakes import ADMIN_ID, CATEGORIES, JWT_SECRET, STATUSES, TAGS, WORDS, free_port, seed, serve_in_process
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESUME = b"%PDF-1.4\n" + b"0" * 20 * 1024 + b"\n%%EOF\n"
+
+# endpoint -> weight
+MIXES = {
+    "public": {
+        "GET /blogs": 30, "GET /blogs/{blog_id}": 35, "GET /blogs/search": 12, "GET /blogs/filter": 8,
+        "GET /blogs/facets": 3, "GET /jobs/jobs": 8, "GET /jobs/jobs/{job_id}": 4,
+    },
+    "mixed": {
+        "GET /blogs": 20, "GET /blogs/{blog_id}": 25, "GET /blogs/search": 8, "GET /blogs/filter": 5,
+        "GET /jobs/jobs": 10, "GET /jobs/jobs/{job_id}": 6, "POST /jobapply/job_apply/{job_id}": 12,
+        "PATCH /emails/applications/{app_id}/status": 6, "GET /jobapply/my_applications": 8,
+    },
+    "admin": {
+        "GET /jobapply/my_applications": 30, "GET /jobapply/my_applications/{app_id}": 15,
+        "PATCH /emails/applications/{app_id}/status": 25, "GET /jobapply/applicants/counts": 10,
+        "GET /jobs/jobs": 15, "POST /blogs": 5,
+    },
+}
+
+
+# A 1200x800 JPEG with one random pixel, so the upload dedup never skips cloudinary
+def thumbnail_jpeg(rng):
+    from PIL import Image
+
+    image = Image.new("RGB", (1200, 800), (200, 80, 40))
+    image.putpixel((0, 0), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+# One request of the given endpoint, returns the response
+class Traffic:
+    def __init__(self, client, tables, admin_token, rng):
+        self.client = client
+        self.rng = rng
+        self.admin = {"Authorization": f"Bearer {admin_token}"}
+        self.blog_ids = [row["id"] for row in tables["blogs"]]
+        self.job_ids = [row["id"] for row in tables["jobs"]]
+        self.app_ids = [row["id"] for row in tables["applications"]]
+
+    async def send(self, endpoint):
+        rng = self.rng
+        if endpoint == "GET /blogs":
+            return await self.client.get("/blogs", params={"limit": 20})
+        if endpoint == "GET /blogs/{blog_id}":
+            return await self.client.get(f"/blogs/{rng.choice(self.blog_ids)}")
+        if endpoint == "GET /blogs/search":
+            query = " ".join(rng.sample(WORDS, rng.randint(1, 3)))
+            return await self.client.get("/blogs/search", params={"q": query, "limit": 10})
+        if endpoint == "GET /blogs/filter":
+            if rng.random() < 0.5:
+                return await self.client.get("/blogs/filter", params={"tags": rng.choice(TAGS)})
+            return await self.client.get("/blogs/filter", params={"category": rng.choice(CATEGORIES)})
+        if endpoint == "GET /blogs/facets":
+            return await self.client.get("/blogs/facets")
+        if endpoint == "GET /jobs/jobs":
+            return await self.client.get("/jobs/jobs", params={"limit": 20})
+        if endpoint == "GET /jobs/jobs/{job_id}":
+            return await self.client.get(f"/jobs/jobs/{rng.choice(self.job_ids)}")
+        if endpoint == "POST /jobapply/job_apply/{job_id}":
+            data = {
+                "user_email": f"{uuid.uuid4().hex}@example.com",
+                "title": "Engineer",
+                "name": "Load Test",
+                "phone_number": "+92 300 0000000",
+            }
+            files = {"resume": ("resume.pdf", RESUME, "application/pdf")}
+            return await self.client.post(f"/jobapply/job_apply/{rng.choice(self.job_ids)}", data=data, files=files)
+        if endpoint == "PATCH /emails/applications/{app_id}/status":
+            return await self.client.patch(
+                f"/emails/applications/{rng.choice(self.app_ids)}/status",
+                json={"status": rng.choice(STATUSES)},
+                headers=self.admin,
+            )
+        if endpoint == "GET /jobapply/my_applications":
+            return await self.client.get("/jobapply/my_applications", params={"limit": 20})
+        if endpoint == "GET /jobapply/my_applications/{app_id}":
+            return await self.client.get(f"/jobapply/my_applications/{rng.choice(self.app_ids)}")
+        if endpoint == "GET /jobapply/applicants/counts":
+            return await self.client.get("/jobapply/applicants/counts")
+        if endpoint == "POST /blogs":
+            data = {
+                "title": "Load test " + " ".join(rng.sample(WORDS, 4)),
+                "content": "<p>" + " ".join(rng.choice(WORDS) for _ in range(300)) + "</p>",
+                "author": "Load Test",
+                "tags": ",".join(rng.sample(TAGS, 2)),
+                "category": rng.choice(CATEGORIES),
+            }
+            files = {"image": ("thumb.jpg", thumbnail_jpeg(rng), "image/jpeg")}
+            return await self.client.post("/blogs", data=data, files=files, headers=self.admin)
+        raise ValueError(f"unknown endpoint {endpoint}")
+
+
+async def client_loop(traffic, mix, deadline, warmup_until, results):
+    endpoints = list(mix)
+    weights = list(mix.values())
+    while time.perf_counter() < deadline:
+        endpoint = traffic.rng.choices(endpoints, weights)[0]
+        start = time.perf_counter()
+        try:
+            response = await traffic.send(endpoint)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+        end = time.perf_counter()
+        if start >= warmup_until:
+            results.setdefault(endpoint, []).append((end - start, status))
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def report(results, seconds):
+    print(f"{'endpoint':<46}{'count':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    total = 0
+    for endpoint, samples in sorted(results.items()):
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        errors = sum(1 for sample in samples if not 200 <= sample[1] < 400)
+        total += len(samples)
+        print(
+            f"{endpoint:<46}{len(samples):>7}{errors:>8}{len(samples) / seconds:>9.1f}"
+            f"{percentile(latencies, 0.5):>9.1f}{percentile(latencies, 0.95):>9.1f}{percentile(latencies, 0.99):>9.1f}"
+        )
+    print(f"{'total':<46}{total:>7}{'':>8}{total / seconds:>9.1f}")
+
+
+def start_app(env, port, workers):
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--log-level", "warning", "--no-access-log", "--workers", str(workers),
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, env={**os.environ, **env})
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app exited with code {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("app did not start in 60s")
+
+
+async def run(args, tables, admin_token, base_url):
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        warmup_until = start + args.warmup
+        deadline = warmup_until + args.duration
+        tasks = [
+            client_loop(
+                Traffic(client, tables, admin_token, random.Random(args.seed + i)),
+                MIXES[args.mix], deadline, warmup_until, results,
+            )
+            for i in range(args.concurrency)
+        ]
+        await asyncio.gather(*tasks)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds before measuring starts")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every supabase call")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--cloudinary-latency", type=float, default=0.1)
+    parser.add_argument("--smtp-latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the app")
+    parser.add_argument("--blogs", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # same seed as the fakes process, so the ids picked here exist there
+    local = FakeSupabase(JWT_SECRET)
+    seed(local, blogs=args.blogs)
+    admin_token = local.make_token(ADMIN_ID, "admin@example.com", 24 * 3600)
+    with tempfile.TemporaryDirectory() as workdir:
+        conn, child_conn = multiprocessing.Pipe()
+        fakes = multiprocessing.Process(
+            target=serve_in_process,
+            args=(child_conn, workdir, args.latency, args.jitter, args.cloudinary_latency, args.smtp_latency,
+                  {"blogs": args.blogs}),
+            daemon=True,
+        )
+        fakes.start()
+        env = conn.recv()
+        port = free_port()
+        app = start_app(env, port, args.workers)
+        try:
+            print(
+                f"mix={args.mix} concurrency={args.concurrency} duration={args.duration}s "
+                f"supabase latency={args.latency}s+{args.jitter}s cloudinary={args.cloudinary_latency}s "
+                f"smtp={args.smtp_latency}s"
+            )
+            results = asyncio.run(run(args, local.tables, admin_token, f"http://127.0.0.1:{port}"))
+            report(results, args.duration)
+            # let the outbox send what the status changes queued
+            time.sleep(1)
+            conn.send("stop")
+            counts = conn.recv()
+            print(
+                f"upstream calls: supabase {counts['supabase']}, cloudinary {counts['cloudinary']}, "
+                f"emails delivered {counts['emails']}"
+            )
+        finally:
+            app.terminate()
+            app.wait(10)
+            fakes.join(10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import asyncio
+import random
+
+
+# Minimal SMTP server that accepts every message and keeps only a count, enough for
+# smtplib.SMTP (no TLS, no auth). Each accepted message waits latency + uniform(0, jitter),
+# error_rate of the messages are refused with a temporary 451 error instead
+class SMTPSink:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.messages = 0
+        self.refused = 0
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        writer.write(b"220 smtp-sink ready\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip().upper()
+                if command.startswith("EHLO"):
+                    writer.write(b"250-smtp-sink\r\n250 8BITMIME\r\n")
+                elif command.startswith(("HELO", "MAIL", "RCPT", "RSET", "NOOP")):
+                    writer.write(b"250 OK\r\n")
+                elif command == "DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        pass
+                    if self.latency or self.jitter:
+                        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+                    if random.random() < self.error_rate:
+                        self.refused += 1
+                        writer.write(b"451 Temporary failure, try again later\r\n")
+                    else:
+                        self.messages += 1
+                        writer.write(b"250 OK queued\r\n")
+                elif command == "QUIT":
+                    writer.write(b"221 Bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b"502 Command not implemented\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
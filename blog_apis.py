@@ -1,34 +1,219 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from supabase import create_client
+from supabase_client import get_supabase
+from cache_utils import TTLCache, MISSING, SingleFlight
+import asyncio
+import hashlib
+import anyio.to_thread
 import os
-from dotenv import load_dotenv
+import time
 from auth import get_current_user, check_admin_or_subadmin
-import cloudinary, cloudinary.uploader
-from cloudinary_utils import upload_image
-from fastapi import UploadFile, File, Form, Depends
+from cloudinary_utils import upload_image_variants, ImageUploadError, reconcile_images, cloudinary_dependency
+from image_dedup import image_hashes
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_fields, fetch_page, encode_cursor, decode_cursor
+from blog_search import BlogSearchIndex, FIELD_WEIGHTS, SUMMARY_FIELDS
+from blog_facets import BlogFacetIndex
+from response_models import BlogResponse, BlogPage, BlogSummaryPage, BlogSearchPage, BlogFacets, BlogChanges
+from delta_sync import fetch_changes, record_deletes
+from fastapi import UploadFile, File, Form, Depends, Query
 from typing import List, Optional
 
-load_dotenv()
 # Create router for blogs
 blog_router = APIRouter(prefix="/blogs", tags=["blogs"])
 
-# supabase connection
-supabase = create_client(
-    os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-)
 # Setup bearer authentication
 security = HTTPBearer()
 
+# Read cache for the public blog endpoints. Every blog write bumps the version,
+# responses cached under an older version are never served again
+blog_cache_version = 0
+blog_read_cache = TTLCache(
+    maxsize=int(os.getenv("BLOG_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("BLOG_CACHE_TTL", "60")),
+)
+# Lets the browser / CDN keep the response, set to "no-cache" to always revalidate with the ETag
+BLOG_CACHE_CONTROL = os.getenv("BLOG_CACHE_CONTROL", "public, max-age=30, stale-while-revalidate=60")
+# Cache misses of the same key share one supabase call. BLOG_STALE / BLOG_LIST_STALE
+# (seconds, 0 = off) keep serving a response for that long after it expired from the
+# read cache, while one background call refreshes it. The keys carry the version,
+# so a stale response is never served after a write
+BLOG_STALE = float(os.getenv("BLOG_STALE", "0"))
+BLOG_LIST_STALE = float(os.getenv("BLOG_LIST_STALE", "0"))
+blog_flight = SingleFlight(
+    "GET /blogs/{blog_id}", max_age=blog_read_cache.ttl if BLOG_STALE else 0, stale=BLOG_STALE
+)
+blog_list_flight = SingleFlight(
+    "GET /blogs", max_age=blog_read_cache.ttl if BLOG_LIST_STALE else 0, stale=BLOG_LIST_STALE
+)
+
+
+def bump_blog_version():
+    global blog_cache_version
+    blog_cache_version += 1
+
+
+# Serialize once (through the response model) and keep the bytes with a strong ETag of the body
+def make_cached_body(model, payload):
+    body = model.model_validate(payload).model_dump_json(exclude_unset=True).encode()
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return body, etag
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+# 304 when the client already has this version, otherwise the cached bytes
+def cached_response(request, cached):
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": BLOG_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# In-memory indexes over all blogs, loaded with one pass over the table at startup
+# and updated by the blog write endpoints below. They are rebuilt from the table every
+# BLOG_INDEX_REFRESH_SECONDS, so writes made by other workers or directly in supabase show up
+blog_search_index = BlogSearchIndex()
+blog_facet_index = BlogFacetIndex()
+blog_indexes_loaded_at = None
+blog_indexes_lock = asyncio.Lock()
+blog_indexes_refresh = None
+# Blog writes made while a load is running, applied again to the indexes it built
+blog_index_journal = None
+INDEX_LOAD_PAGE_SIZE = 1000
+BLOG_INDEX_REFRESH_SECONDS = float(os.getenv("BLOG_INDEX_REFRESH_SECONDS", "300"))
+
+
+def build_blog_indexes(blogs):
+    search_index, facet_index = BlogSearchIndex(), BlogFacetIndex()
+    search_index.rebuild(blogs)
+    facet_index.rebuild(blogs)
+    return search_index, facet_index
+
+
+# Page through the table and build new indexes on a worker thread, the current ones keep
+# serving until they are swapped in
+async def load_blog_indexes():
+    global blog_search_index, blog_facet_index, blog_indexes_loaded_at, blog_index_journal
+    columns = ",".join(dict.fromkeys(tuple(FIELD_WEIGHTS) + SUMMARY_FIELDS))
+    blog_index_journal = []
+    try:
+        blogs = []
+        cursor = None
+        while True:
+            query = get_supabase().table("blogs").select(columns)
+            rows, cursor = await fetch_page(query, cursor, INDEX_LOAD_PAGE_SIZE)
+            blogs.extend(rows)
+            if cursor is None:
+                break
+        search_index, facet_index = await anyio.to_thread.run_sync(build_blog_indexes, blogs)
+        journal = blog_index_journal
+    finally:
+        blog_index_journal = None
+    blog_search_index, blog_facet_index = search_index, facet_index
+    # a write during the load may be missing from the pages that were already read
+    for function, value in journal:
+        function(value)
+    blog_indexes_loaded_at = time.monotonic()
+
 
-# Make api for uploading image
+async def refresh_blog_indexes():
+    global blog_indexes_refresh
+    try:
+        async with blog_indexes_lock:
+            await load_blog_indexes()
+    except Exception as e:
+        print(f"Could not refresh the blog indexes: {e}")
+    finally:
+        blog_indexes_refresh = None
+
+
+# Load on first use when the startup load failed. Once loaded, indexes older than
+# BLOG_INDEX_REFRESH_SECONDS are rebuilt in the background and served meanwhile
+async def ensure_blog_indexes():
+    global blog_indexes_refresh
+    if blog_indexes_loaded_at is None:
+        async with blog_indexes_lock:
+            if blog_indexes_loaded_at is None:
+                await load_blog_indexes()
+        return
+    if time.monotonic() - blog_indexes_loaded_at >= BLOG_INDEX_REFRESH_SECONDS and blog_indexes_refresh is None:
+        blog_indexes_refresh = asyncio.create_task(refresh_blog_indexes())
+
+
+# Called with the rows supabase returned from a blog write
+def index_blog(row):
+    if blog_index_journal is not None:
+        blog_index_journal.append((index_blog, row))
+    blog_search_index.add(row)
+    blog_facet_index.add(row)
+
+
+def unindex_blog(blog_id):
+    if blog_index_journal is not None:
+        blog_index_journal.append((unindex_blog, blog_id))
+    blog_search_index.remove(blog_id)
+    blog_facet_index.remove(blog_id)
+
+
+# Columns the list endpoint can project with ?fields=
+BLOG_FIELDS = {
+    "title": "title",
+    "content": "content",
+    "thumbnail": "thumbnail",
+    "thumbnail_variants": "thumbnail_variants",
+    "internal_urls": "internal_urls",
+    "internal_variants": "internal_variants",
+    "author": "author",
+    "tags": "tags",
+    "category": "category",
+    "created_by": "created_by",
+}
+
+
+# Make api for uploading image, send image_files to upload several at once.
+# Images are downsized / re-encoded first and the resized variants are uploaded too
 @blog_router.post("/uploadimage")
-async def upload_image_endpoint(image_file: UploadFile = File(None)):
-    if not image_file:
+async def upload_image_endpoint(
+    image_file: UploadFile = File(None),
+    image_files: Optional[List[UploadFile]] = File(None),
+):
+    if not image_file and not image_files:
         raise HTTPException(status_code=400, detail="No file provided")
-    file_content = await image_file.read()
-    response = cloudinary.uploader.upload(file_content)
-    return {"url": response.get("secure_url")}
+    try:
+        if image_files:
+            images = await upload_image_variants(image_files)
+            return {"urls": [image["url"] for image in images], "variants": [image["variants"] for image in images]}
+        image = (await upload_image_variants([image_file]))[0]
+        return {"url": image["url"], "variants": image["variants"]}
+    except ImageUploadError as img_error:
+        raise HTTPException(status_code=400, detail=f"Image upload failed: {str(img_error)}")
+
+
+# Drop dedup entries of images that were deleted on cloudinary directly
+@blog_router.post("/images/reconcile")
+async def reconcile_image_cache(user=Depends(get_current_user)):
+    await check_admin_or_subadmin(user)
+    try:
+        return await cloudinary_dependency.run_sync(reconcile_images)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reconciling images: {str(e)}")
+
+
+# Size and hit rate of the image dedup cache
+@blog_router.get("/images/stats")
+async def image_cache_stats(user=Depends(get_current_user)):
+    await check_admin_or_subadmin(user)
+    return await anyio.to_thread.run_sync(image_hashes.stats)
 
 
 # sort the blog with filters latest and oldest
@@ -69,39 +254,38 @@ async def create_blog(
     user=Depends(get_current_user),
 ):
     try:
-        check_admin_or_subadmin(user)
+        await check_admin_or_subadmin(user)
+        supabase = get_supabase()
         image_url = None  # default none
+        thumbnail_variants = None
+        # Upload thumbnail and internal images together, the thumbnail goes first
+        files = ([image] if image else []) + (internal_images or [])
+        try:
+            images = await upload_image_variants(files)
+        except ImageUploadError as img_error:
+            if image and img_error.index == 0:
+                detail = f"Thumbnail image not found: {str(img_error)}"
+            else:
+                detail = f"Internal image upload failed: {str(img_error)}"
+            raise HTTPException(status_code=400, detail=detail)
         if image:
-            try:
-                file_content = await image.read()
-                image_url = upload_image(file_content)
-            except Exception as img_error:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Thumbnail image not found: {str(img_error)}",
-                )
-        # Store internal image urls
-        internal_urls = []
-        if internal_images:
-            for img in internal_images:
-                try:
-                    file_content = await img.read()
-                    url = upload_image(file_content)
-                    internal_urls.append(url)
-                except Exception as img_error:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Internal image upload failed: {str(img_error)}",
-                    )
+            thumbnail = images.pop(0)
+            image_url = thumbnail["url"]
+            thumbnail_variants = thumbnail["variants"]
+        # Store internal image urls, the resized variants are kept next to them
+        internal_urls = [internal["url"] for internal in images]
+        internal_variants = [internal["variants"] for internal in images]
         # Convert comma text to list
         tags_list = tags.split(",")
         try:
-            supabase.table("blogs").insert(
+            response = await supabase.table("blogs").insert(
                 {
                     "title": title,
                     "content": content,
                     "thumbnail": image_url,
+                    "thumbnail_variants": thumbnail_variants,
                     "internal_urls": internal_urls,
+                    "internal_variants": internal_variants,
                     "created_by": user.user.id,
                     "author": author,
                     # "author_images": author_image,
@@ -111,10 +295,14 @@ async def create_blog(
                     "category": category,
                 }
             ).execute()
+        except HTTPException:
+            raise
         except Exception as db_error:
             raise HTTPException(
                 status_code=400, detail=f"Failed to save blog: {str(db_error)}"
             )
+        bump_blog_version()
+        index_blog(response.data[0])
         # Return success message
         return {"message": "Blog created successfully"}
     except HTTPException:
@@ -123,16 +311,105 @@ async def create_blog(
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
+# Full text search over title, content, tags and category, best match first
+# e.g. /blogs/search?q=pyth fastapi&limit=20&offset=0 (the words also match as prefixes)
+@blog_router.get("/search", response_model=BlogSearchPage, response_model_exclude_unset=True)
+async def search_blogs(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+):
+    try:
+        await ensure_blog_indexes()
+        results, total = blog_search_index.search(q, limit, offset)
+        next_offset = offset + limit if offset + limit < total else None
+        return {"results": results, "total": total, "next_offset": next_offset}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching blogs: {str(e)}")
+
+
+# Tag cloud: number of blogs per tag and per category, biggest first
+@blog_router.get("/facets", response_model=BlogFacets)
+async def get_blog_facets(limit: Optional[int] = Query(None, ge=1)):
+    try:
+        await ensure_blog_indexes()
+        return {
+            "tags": blog_facet_index.counts(blog_facet_index.tags, limit),
+            "categories": blog_facet_index.counts(blog_facet_index.categories, limit),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching blog facets: {str(e)}")
+
+
+# Blogs with the given tags and/or category, newest first
+# e.g. /blogs/filter?tags=python,fastapi&match=any&category=engineering&limit=20
+# match=all (default) needs every tag, match=any at least one of them
+@blog_router.get("/filter", response_model=BlogSummaryPage, response_model_exclude_unset=True)
+async def filter_blogs(
+    tags: Optional[str] = None,
+    category: Optional[str] = None,
+    match: str = Query("all", pattern="^(all|any)$"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    tag_list = [tag for tag in (tags or "").split(",") if tag.strip()]
+    if not tag_list and not category:
+        raise HTTPException(status_code=400, detail="Provide tags or category")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+        await ensure_blog_indexes()
+        blogs, has_more = blog_facet_index.filter(tag_list, category, match, limit, after)
+        next_cursor = encode_cursor(blogs[-1]) if has_more else None
+        return {"blogs": blogs, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error filtering blogs: {str(e)}")
+
+
+# Blogs created, updated or deleted since ?since= (the sync_token of the previous call,
+# none for a first full sync), admin/subadmin only. Call again with the new token while
+# has_more. Not cached, every token is a different query
+@blog_router.get("/sync", response_model=BlogChanges, response_model_exclude_unset=True)
+async def sync_blogs(
+    since: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    try:
+        await check_admin_or_subadmin(user)
+        return await fetch_changes("blogs", parse_fields(fields, BLOG_FIELDS), since, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error syncing blogs: {str(e)}")
+
+
 # Get one blog api
-@blog_router.get("/{blog_id}")
-def get_blog(blog_id: str):
+@blog_router.get("/{blog_id}", response_model=BlogResponse)
+async def get_blog(blog_id: str, request: Request):
     try:
-        # Fetch blog from blogs table
-        blog = supabase.table("blogs").select("*").eq("id", blog_id).execute()
+        cache_key = (blog_cache_version, "blog", blog_id)
+        cached = blog_read_cache.get(cache_key)
+        if cached is MISSING:
+
+            async def load():
+                # Fetch blog from blogs table
+                blog = await get_supabase().table("blogs").select("*").eq("id", blog_id).execute()
 
-        if not blog.data:
-            raise HTTPException(status_code=404, detail="Blog not found")
-        return {"blog": blog.data[0]}
+                if not blog.data:
+                    raise HTTPException(status_code=404, detail="Blog not found")
+                body = make_cached_body(BlogResponse, {"blog": blog.data[0]})
+                blog_read_cache.set(cache_key, body)
+                return body
+
+            cached = await blog_flight.run(cache_key, load)
+        return cached_response(request, cached)
     except HTTPException:
         raise
     except Exception as e:
@@ -140,35 +417,59 @@ def get_blog(blog_id: str):
 
 
 # Get all blogs api
-@blog_router.get("")
-@blog_router.get("/")
-def get_blogs():
+@blog_router.get("", response_model=BlogPage)
+@blog_router.get("/", response_model=BlogPage)
+async def get_blogs(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
     try:
-        # Fetch all blogs from blogs table
-        blogs = supabase.table("blogs").select("*").execute()
-        return {"blogs": blogs.data}
+        cache_key = (blog_cache_version, "list", limit, cursor, fields)
+        cached = blog_read_cache.get(cache_key)
+        if cached is MISSING:
+
+            async def load():
+                # Fetch one page of blogs, newest first
+                query = get_supabase().table("blogs").select(parse_fields(fields, BLOG_FIELDS))
+                blogs, next_cursor = await fetch_page(query, cursor, limit)
+                body = make_cached_body(BlogPage, {"blogs": blogs, "next_cursor": next_cursor})
+                blog_read_cache.set(cache_key, body)
+                return body
+
+            cached = await blog_list_flight.run(cache_key, load)
+        return cached_response(request, cached)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching blogs: {str(e)}")
 
 
 # Update blog api
 @blog_router.put("/{blog_id}")
-def update_blog(blog_id: str, blog: dict, user=Depends(get_current_user)):
+async def update_blog(blog_id: str, blog: dict, user=Depends(get_current_user)):
     try:
         # check admin or subadmin
-        check_admin_or_subadmin(user)
+        await check_admin_or_subadmin(user)
+        changes = {
+            "title": blog["title"],
+            "content": blog["content"],
+            "thumbnail": blog["image_url"],
+            "internal_urls": blog["internal_urls"],
+            "author": blog["author"],
+            "tags": blog["tags_list"],
+            "category": blog["category"],
+        }
+        # variant urls as returned by /blogs/uploadimage, only when the images changed
+        for field in ("thumbnail_variants", "internal_variants"):
+            if field in blog:
+                changes[field] = blog[field]
         # update blog in blogs table
-        supabase.table("blogs").update(
-            {
-                "title": blog["title"],
-                "content": blog["content"],
-                "thumbnail": blog["image_url"],
-                "internal_urls": blog["internal_urls"],
-                "author": blog["author"],
-                "tags": blog["tags_list"],
-                "category": blog["category"],
-            }
-        ).eq("id", blog_id).execute()
+        response = await get_supabase().table("blogs").update(changes).eq("id", blog_id).execute()
+        bump_blog_version()
+        for row in response.data:
+            index_blog(row)
 
         return {"message": "Blog updated successfully"}
     except HTTPException:
@@ -179,12 +480,15 @@ def update_blog(blog_id: str, blog: dict, user=Depends(get_current_user)):
 
 # Delete blog api
 @blog_router.delete("/{blog_id}")
-def delete_blog(blog_id: str, user=Depends(get_current_user)):
+async def delete_blog(blog_id: str, user=Depends(get_current_user)):
     try:
         # check admin or subadmin
-        check_admin_or_subadmin(user)
+        await check_admin_or_subadmin(user)
         # delete blog from blogs table
-        supabase.table("blogs").delete().eq("id", blog_id).execute()
+        response = await get_supabase().table("blogs").delete().eq("id", blog_id).execute()
+        bump_blog_version()
+        unindex_blog(blog_id)
+        await record_deletes("blogs", response.data)
         return {"message": "Blog deleted successfully"}
     except HTTPException:
         raise
@@ -0,0 +1,131 @@
+import heapq
+from bisect import bisect_left, insort
+from blog_search import SUMMARY_FIELDS
+
+
+# "  Python " and "python" are the same tag
+def facet_key(value):
+    return value.strip().lower() if isinstance(value, str) else ""
+
+
+# Tag and category -> blog ids sorted by created_at, so a tag page or the tag cloud
+# is answered from memory instead of scanning the blogs table
+class BlogFacetIndex:
+    def __init__(self):
+        self.tags = {}  # tag -> [(created_at, blog_id), ...] oldest first
+        self.categories = {}  # category -> [(created_at, blog_id), ...] oldest first
+        self.docs = {}  # blog_id -> (created_at, set of tags, category)
+        self.summaries = {}  # blog_id -> small dict returned in results
+
+    def __len__(self):
+        return len(self.docs)
+
+    @staticmethod
+    def _insert(facets, key, entry, bulk):
+        posting = facets.setdefault(key, [])
+        if bulk:
+            posting.append(entry)
+        else:
+            insort(posting, entry)
+
+    @staticmethod
+    def _delete(facets, key, entry):
+        posting = facets.get(key)
+        if posting is None:
+            return
+        index = bisect_left(posting, entry)
+        if index < len(posting) and posting[index] == entry:
+            del posting[index]
+        if not posting:
+            del facets[key]
+
+    # Add a blog, or move it to its new tags / category when it is already indexed
+    def add(self, blog, _bulk=False):
+        blog_id = blog["id"]
+        if blog_id in self.docs:
+            self.remove(blog_id)
+        created_at = blog.get("created_at") or ""
+        tags = {facet_key(tag) for tag in blog.get("tags") or []} - {""}
+        category = facet_key(blog.get("category"))
+        entry = (created_at, blog_id)
+        for tag in tags:
+            self._insert(self.tags, tag, entry, _bulk)
+        if category:
+            self._insert(self.categories, category, entry, _bulk)
+        self.docs[blog_id] = (created_at, tags, category)
+        self.summaries[blog_id] = {field: blog.get(field) for field in SUMMARY_FIELDS}
+
+    def remove(self, blog_id):
+        doc = self.docs.pop(blog_id, None)
+        if doc is None:
+            return
+        created_at, tags, category = doc
+        entry = (created_at, blog_id)
+        for tag in tags:
+            self._delete(self.tags, tag, entry)
+        if category:
+            self._delete(self.categories, category, entry)
+        self.summaries.pop(blog_id, None)
+
+    # Replace the whole index with the given blogs
+    def rebuild(self, blogs):
+        self.tags, self.categories, self.docs, self.summaries = {}, {}, {}, {}
+        for blog in blogs:
+            self.add(blog, _bulk=True)
+        for posting in list(self.tags.values()) + list(self.categories.values()):
+            posting.sort()
+
+    # Number of blogs per tag / category, biggest first
+    def counts(self, facets, limit=None):
+        items = [(key, len(posting)) for key, posting in facets.items()]
+        if limit is None:
+            items.sort(key=lambda item: (-item[1], item[0]))
+        else:
+            items = heapq.nsmallest(limit, items, key=lambda item: (-item[1], item[0]))
+        return [{"name": key, "count": count} for key, count in items]
+
+    # Entries of one posting list newest first, starting below after=(created_at, id)
+    @staticmethod
+    def _newest_first(posting, after):
+        end = len(posting) if after is None else bisect_left(posting, after)
+        for index in range(end - 1, -1, -1):
+            yield posting[index]
+
+    # One page of blogs matching the tags (all of them with match="all", any with
+    # match="any") and the category, newest first. after is the (created_at, id) of
+    # the last blog of the previous page
+    def filter(self, tags=(), category=None, match="all", limit=50, after=None):
+        tags = {facet_key(tag) for tag in tags} - {""}
+        category = facet_key(category) if category else None
+        postings = [self.tags.get(tag, []) for tag in tags]
+        if not postings:
+            if not category:
+                return [], False
+            candidates = self._newest_first(self.categories.get(category, []), after)
+        elif match == "any":
+            # merge the posting lists, a blog with several of the tags shows up once
+            merged = heapq.merge(*(self._newest_first(posting, after) for posting in postings), reverse=True)
+            candidates = _unique(merged)
+        else:
+            # walk the shortest list and check the other tags on each blog
+            candidates = self._newest_first(min(postings, key=len), after)
+        results = []
+        for entry in candidates:
+            _, blog_tags, blog_category = self.docs[entry[1]]
+            if match != "any" and not tags <= blog_tags:
+                continue
+            if category and blog_category != category:
+                continue
+            if len(results) == limit:
+                return results, True
+            results.append(self.summaries[entry[1]])
+        return results, False
+
+
+# Drop repeated entries from a sorted stream
+def _unique(entries):
+    previous = None
+    for entry in entries:
+        if entry != previous:
+            yield entry
+        previous = entry
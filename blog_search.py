@@ -0,0 +1,166 @@
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+
+# Words are lowercase letters/digits, html tags in the content are dropped first
+TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+TAG_RE = re.compile(r"<[^>]+>")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "with",
+}
+
+# A match in the title counts three times as much as one in the content
+FIELD_WEIGHTS = {"title": 3.0, "tags": 2.0, "category": 2.0, "content": 1.0}
+# Columns kept per blog so results can be returned without asking supabase
+SUMMARY_FIELDS = ("id", "title", "author", "category", "tags", "thumbnail", "thumbnail_variants", "created_at")
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+AVERAGE_DRIFT = 0.1
+# A prefix like "pyth" expands to at most this many indexed words, each scored a bit lower
+MAX_PREFIX_EXPANSIONS = 50
+PREFIX_WEIGHT = 0.6
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token for token in TOKEN_RE.findall(TAG_RE.sub(" ", text).lower()) if token not in STOPWORDS]
+
+
+# Inverted index over title, content, tags and category with BM25 ranking
+class BlogSearchIndex:
+    def __init__(self):
+        self.postings = {}  # term -> {blog_id: impact}
+        self.terms = []  # sorted list of all terms, for prefix lookups
+        self.doc_terms = {}  # blog_id -> {term: weighted frequency}, to remove or rescore it
+        self.doc_length = {}  # blog_id -> weighted number of tokens
+        self.total_length = 0.0
+        self.average_length = 1.0  # the average the impacts in postings were computed with
+        self.summaries = {}  # blog_id -> small dict returned in search results
+
+    def __len__(self):
+        return len(self.doc_length)
+
+    def _weighted_terms(self, blog):
+        frequencies = {}
+        length = 0.0
+        for field, weight in FIELD_WEIGHTS.items():
+            value = blog.get(field)
+            if isinstance(value, list):
+                value = " ".join(str(item) for item in value if item)
+            for token in tokenize(value):
+                frequencies[token] = frequencies.get(token, 0.0) + weight
+                length += weight
+        return frequencies, length
+
+    # BM25 part of a term that only depends on the blog, computed when the blog is added
+    # so a query only has to multiply it with the idf
+    def _impact(self, frequency, length):
+        norm = K1 * (1 - B + B * length / self.average_length)
+        return frequency * (K1 + 1) / (frequency + norm)
+
+    # Add a blog, or replace it when it is already in the index
+    def add(self, blog, _bulk=False):
+        blog_id = blog["id"]
+        if blog_id in self.doc_length:
+            self.remove(blog_id)
+        frequencies, length = self._weighted_terms(blog)
+        self.doc_terms[blog_id] = frequencies
+        self.doc_length[blog_id] = length
+        self.total_length += length
+        self.summaries[blog_id] = {field: blog.get(field) for field in SUMMARY_FIELDS}
+        if _bulk:
+            return
+        for term, frequency in frequencies.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                insort(self.terms, term)
+            posting[blog_id] = self._impact(frequency, length)
+        self._check_average()
+
+    def remove(self, blog_id):
+        frequencies = self.doc_terms.pop(blog_id, None)
+        if frequencies is None:
+            return
+        for term in frequencies:
+            posting = self.postings[term]
+            posting.pop(blog_id, None)
+            if not posting:
+                del self.postings[term]
+                index = bisect_left(self.terms, term)
+                if index < len(self.terms) and self.terms[index] == term:
+                    del self.terms[index]
+        self.total_length -= self.doc_length.pop(blog_id)
+        self.summaries.pop(blog_id, None)
+        self._check_average()
+
+    # The impacts were computed with the average blog length of that moment, they are
+    # recomputed once the average has drifted by more than AVERAGE_DRIFT
+    def _check_average(self):
+        current = self.total_length / len(self.doc_length) if self.doc_length else 1.0
+        if abs(current - self.average_length) > AVERAGE_DRIFT * self.average_length:
+            self._compute_postings()
+
+    def _compute_postings(self):
+        self.average_length = (self.total_length / len(self.doc_length) if self.doc_length else 0.0) or 1.0
+        postings = {}
+        for blog_id, frequencies in self.doc_terms.items():
+            length = self.doc_length[blog_id]
+            for term, frequency in frequencies.items():
+                posting = postings.get(term)
+                if posting is None:
+                    posting = postings[term] = {}
+                posting[blog_id] = self._impact(frequency, length)
+        self.postings = postings
+        self.terms = sorted(postings)
+
+    # Replace the whole index with the given blogs
+    def rebuild(self, blogs):
+        self.doc_terms, self.doc_length, self.summaries = {}, {}, {}
+        self.total_length = 0.0
+        for blog in blogs:
+            self.add(blog, _bulk=True)
+        self._compute_postings()
+
+    # Indexed words that start with prefix (the word itself first when it exists)
+    def expand(self, prefix):
+        start = bisect_left(self.terms, prefix)
+        matches = []
+        for term in self.terms[start:start + MAX_PREFIX_EXPANSIONS + 1]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    # BM25 scores of every blog matching at least one query word
+    def score(self, query):
+        scores = {}
+        count = len(self.doc_length)
+        if not count:
+            return scores
+        weighted = []
+        for token in set(tokenize(query)):
+            for term in self.expand(token):
+                posting = self.postings[term]
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                weighted.append((posting, idf if term == token else idf * PREFIX_WEIGHT))
+        for posting, weight in weighted:
+            get = scores.get
+            for blog_id, impact in posting.items():
+                scores[blog_id] = get(blog_id, 0.0) + weight * impact
+        return scores
+
+    # One page of results, best first
+    def search(self, query, limit=20, offset=0):
+        scores = self.score(query)
+        top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+        results = [
+            {**self.summaries[blog_id], "score": round(score, 4)}
+            for blog_id, score in top[offset:offset + limit]
+        ]
+        return results, len(scores)
+
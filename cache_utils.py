@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+# Marker for "key not in cache" so that None can be cached as a real value
+MISSING = object()
+
+
+# Small in-process cache: bounded (LRU eviction) and every entry expires after a TTL
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (deadline, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            deadline, value = entry
+            # expired entries count as a miss and are dropped
+            if deadline <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # expires_at is a unix timestamp (e.g. jwt "exp"), the entry never outlives it
+    def set(self, key, value, ttl=None, expires_at=None):
+        ttl = self.ttl if ttl is None else ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    # hit/miss counters for the stats endpoints
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+        }
+
+
+# Remembers the result of an operation per idempotency key. A retry with the same key
+# gets the stored result, and a retry that arrives while the first call is still
+# running waits for it instead of running the operation a second time
+class IdempotencyStore:
+    def __init__(self, maxsize=10000, ttl=24 * 3600):
+        self.results = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight = {}
+        self.replayed = 0
+
+    async def run(self, key, operation):
+        result = self.results.get(key)
+        if result is not MISSING:
+            self.replayed += 1
+            return result
+        if key in self._inflight:
+            self.replayed += 1
+            return await asyncio.shield(self._inflight[key])
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await operation()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark as retrieved when nobody else was waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        # only successful results are kept, a failed call can be retried
+        self.results.set(key, result)
+        future.set_result(result)
+        return result
+
+
+# Every SingleFlight by name, for the stats endpoint
+single_flights = {}
+
+
+# Request coalescing for hot reads: callers asking for the same key while a call is in
+# flight wait for that call instead of making their own. Optionally the last result is
+# kept: for max_age seconds it is served as it is, for `stale` seconds after that it is
+# still served right away while one background call refreshes it
+class SingleFlight:
+    def __init__(self, name, max_age=0.0, stale=0.0, maxsize=1024):
+        self.name = name
+        self.max_age = max_age
+        self.stale = stale
+        self.maxsize = maxsize
+        self._results = OrderedDict()  # key -> (fetched at, result)
+        self._inflight = {}  # key -> asyncio.Task
+        # bumped by clear(), calls started before it don't store their result
+        self._generation = 0
+        self.counts = {"calls": 0, "upstream": 0, "coalesced": 0, "fresh": 0, "stale": 0, "errors": 0}
+        single_flights[name] = self
+
+    async def run(self, key, operation):
+        self.counts["calls"] += 1
+        entry = self._results.get(key)
+        if entry is not None:
+            fetched_at, result = entry
+            age = time.monotonic() - fetched_at
+            if age < self.max_age:
+                self.counts["fresh"] += 1
+                return result
+            if age < self.max_age + self.stale:
+                self.counts["stale"] += 1
+                if key not in self._inflight:
+                    self._start(key, operation)
+                return result
+            del self._results[key]
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counts["coalesced"] += 1
+        else:
+            task = self._start(key, operation)
+        # a caller that goes away doesn't cancel the call the others are waiting for
+        return await asyncio.shield(task)
+
+    def _start(self, key, operation):
+        self.counts["upstream"] += 1
+        task = asyncio.ensure_future(operation())
+        self._inflight[key] = task
+        generation = self._generation
+        task.add_done_callback(lambda done: self._finished(key, done, generation))
+        return task
+
+    def _finished(self, key, task, generation):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            # errors are never kept, the next caller tries again
+            self.counts["errors"] += 1
+            return
+        if generation != self._generation or self.max_age + self.stale <= 0:
+            return
+        self._results[key] = (time.monotonic(), task.result())
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    # After a write: drop kept results, and calls already in flight are not joined anymore
+    def clear(self):
+        self._generation += 1
+        self._results.clear()
+        self._inflight.clear()
+
+    def stats(self):
+        return {**self.counts, "max_age_seconds": self.max_age, "stale_seconds": self.stale, "kept": len(self._results)}
@@ -0,0 +1,150 @@
+import importlib
+import os
+import threading
+import anyio.to_thread
+from resilience import Dependency, GuardedTransport
+
+# SDKs that are only imported when a client is first needed. Together they take
+# longer to import than the whole app, warm_up() imports them in a worker thread
+SDK_MODULES = ("supabase", "supabase_auth", "cloudinary.uploader", "cloudinary.api")
+
+# Timeout budget, circuit breaker and bulkhead per supabase service (resilience.py). The
+# bulkheads add up to less than SUPABASE_MAX_CONNECTIONS, so slow storage uploads or
+# auth calls can never take the connections the database reads need
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_SERVICES = {
+    "supabase_rest": Dependency("supabase_rest", timeout=SUPABASE_TIMEOUT, concurrency=150, reset_after=15),
+    "supabase_auth": Dependency("supabase_auth", timeout=SUPABASE_TIMEOUT, concurrency=20, reset_after=15),
+    "supabase_storage": Dependency("supabase_storage", timeout=60, concurrency=20, reset_after=15),
+}
+
+
+# The external clients of the app, each built once on first use:
+#   http       pooled httpx.AsyncClient shared by the database, storage and auth clients
+#   supabase   service role client used by every router
+#   auth       separate auth client for signup/login, so a user session never replaces
+#              the service role key on the shared database client
+#   cloudinary the configured cloudinary module
+# The app lifespan starts warm_up() and calls aclose() on shutdown
+class Clients:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._http = None
+        self._supabase = None
+        self._auth = None
+        self._cloudinary = None
+
+    @property
+    def http(self):
+        if self._http is None:
+            self._build_supabase()
+        return self._http
+
+    @property
+    def supabase(self):
+        if self._supabase is None:
+            self._build_supabase()
+        return self._supabase
+
+    @property
+    def auth(self):
+        if self._auth is None:
+            self._build_supabase()
+        return self._auth
+
+    @property
+    def cloudinary(self):
+        if self._cloudinary is None:
+            self._build_cloudinary()
+        return self._cloudinary
+
+    def _build_supabase(self):
+        with self._lock:
+            if self._supabase is not None:
+                return
+            import httpx
+            from supabase import AsyncClient, AsyncClientOptions
+            from supabase_auth import AsyncGoTrueClient
+            from metrics import TimedTransport, classify_supabase
+
+            url = os.getenv("SUPABASE_URL")
+            key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("SUPABASE_MAX_CONNECTIONS", "200")),
+                    max_keepalive_connections=int(os.getenv("SUPABASE_MAX_KEEPALIVE", "50")),
+                    keepalive_expiry=float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30")),
+                ),
+                http2=os.getenv("SUPABASE_HTTP2", "true").lower() == "true",
+            )
+            http = httpx.AsyncClient(
+                # every call is guarded and timed per service (rest / auth / storage), the
+                # guard sets the timeout of the service on each request
+                transport=GuardedTransport(TimedTransport(transport), SUPABASE_SERVICES, classify_supabase),
+                timeout=httpx.Timeout(SUPABASE_TIMEOUT),
+                follow_redirects=True,
+            )
+            self._auth = AsyncGoTrueClient(
+                url=f"{url}/auth/v1",
+                headers={"apiKey": key, "Authorization": f"Bearer {key}"},
+                http_client=http,
+                auto_refresh_token=False,
+                persist_session=False,
+            )
+            self._http = http
+            # set last, the properties use it to tell whether everything was built
+            self._supabase = AsyncClient(
+                url,
+                key,
+                AsyncClientOptions(
+                    httpx_client=http,
+                    auto_refresh_token=False,
+                    persist_session=False,
+                ),
+            )
+
+    def _build_cloudinary(self):
+        with self._lock:
+            if self._cloudinary is not None:
+                return
+            import cloudinary
+            import cloudinary.api
+            import cloudinary.uploader
+
+            cloudinary.config(
+                cloud_name=os.getenv("Cloudinary_CLOUD_NAME"),
+                api_key=os.getenv("Cloudinary_API_KEY"),
+                api_secret=os.getenv("Cloudinary_API_SECRET"),
+            )
+            self._cloudinary = cloudinary
+
+    # Inject prebuilt clients instead of building them from the environment, e.g. a
+    # supabase client on another transport in a test. The database, auth and http clients
+    # share one pool, so they are given together. Routers and helpers (auth, counters,
+    # blog indexes, outbox) all get their clients through this container
+    def provide(self, http=None, supabase=None, auth=None, cloudinary=None):
+        given = [client is not None for client in (http, supabase, auth)]
+        if any(given) and not all(given):
+            raise ValueError("http, supabase and auth are provided together")
+        with self._lock:
+            if supabase is not None:
+                self._http, self._auth, self._supabase = http, auth, supabase
+            if cloudinary is not None:
+                self._cloudinary = cloudinary
+
+    # Import the SDKs in a worker thread, then build the clients (cheap once imported)
+    async def warm_up(self):
+        await anyio.to_thread.run_sync(lambda: [importlib.import_module(name) for name in SDK_MODULES])
+        self._build_supabase()
+        self._build_cloudinary()
+
+    # Close the connection pool, the next use builds a new one
+    async def aclose(self):
+        with self._lock:
+            http = self._http
+            self._http = self._supabase = self._auth = None
+        if http is not None:
+            await http.aclose()
+
+
+clients = Clients()
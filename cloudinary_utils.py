@@ -1,19 +1,191 @@
-import cloudinary
-import cloudinary.uploader
+import asyncio
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
-#Cloudinary config
-cloudinary.config(
-    cloud_name=os.getenv("Cloudinary_CLOUD_NAME"),
-    api_key=os.getenv("Cloudinary_API_KEY"),
-    api_secret=os.getenv("Cloudinary_API_SECRET")
+import anyio.to_thread
+from clients import clients
+from image_dedup import image_hashes, read_and_hash
+from image_processing import IMAGE_FORMAT, IMAGE_MAX_DIMENSION, IMAGE_QUALITY, IMAGE_VARIANTS, process_image_async
+from metrics import track
+from resilience import Dependency, UpstreamFailed, UpstreamUnavailable
+
+# How many images are sent to cloudinary at the same time by upload_images
+UPLOAD_CONCURRENCY = int(os.getenv("CLOUDINARY_UPLOAD_CONCURRENCY", "4"))
+
+
+# Errors cloudinary answers for the request itself (bad image, unknown id) say nothing
+# about its health, anything else (timeouts, 5xx, connection errors) counts for the breaker
+def cloudinary_failed(error):
+    from cloudinary.exceptions import AlreadyExists, AuthorizationRequired, BadRequest, NotAllowed, NotFound
+
+    return not isinstance(error, (AlreadyExists, AuthorizationRequired, BadRequest, NotAllowed, NotFound))
+
+
+# The SDK turns timeouts into a plain cloudinary Error raised while handling the urllib3 /
+# socket timeout, so look at what it was raised from
+def cloudinary_timed_out(error):
+    from urllib3.exceptions import TimeoutError as Urllib3Timeout
+
+    return isinstance(error.__context__ or error, (TimeoutError, Urllib3Timeout))
+
+
+# Timeout budget, circuit breaker and bulkhead of cloudinary (resilience.py). The calls
+# run on the bulkhead's own threads, so slow uploads never hold the shared threadpool
+cloudinary_dependency = Dependency(
+    "cloudinary", timeout=30, concurrency=8, wait=10, reset_after=30, is_failure=cloudinary_failed
 )
-#First upload image to cloudinary and get the url
-def upload_image(image_file):
-    response = cloudinary.uploader.upload(image_file)
-    return response.get("secure_url")
 
 
+# Raised by upload_images, index is the position of the file that failed
+class ImageUploadError(Exception):
+    def __init__(self, index, error):
+        super().__init__(str(error))
+        self.index = index
+        self.error = error
+
+
+# Cloudinary calls, guarded and timed for /metrics. The SDK is configured by the clients container on first use
+def cloudinary_upload(content):
+    with cloudinary_dependency.guard(), track("cloudinary", "upload"):
+        return clients.cloudinary.uploader.upload(content, timeout=cloudinary_dependency.timeout)
+
+
+def cloudinary_destroy(public_id):
+    with cloudinary_dependency.guard(), track("cloudinary", "destroy"):
+        return clients.cloudinary.uploader.destroy(public_id, timeout=cloudinary_dependency.timeout)
+
+
+def delete_image(public_id):
+    cloudinary_destroy(public_id)
+    image_hashes.forget(public_id)
+
+
+# Which of these public ids still exist on cloudinary (one admin api call per 100 ids)
+def existing_public_ids(public_ids):
+    with cloudinary_dependency.guard(), track("cloudinary", "resources"):
+        response = clients.cloudinary.api.resources_by_ids(
+            public_ids, max_results=len(public_ids), timeout=cloudinary_dependency.timeout
+        )
+    return [resource["public_id"] for resource in response.get("resources", [])]
+
+
+# Drop dedup entries whose asset was deleted outside this service
+def reconcile_images():
+    return image_hashes.reconcile(existing_public_ids)
+
+
+# Dedup key of one processed image made from the original bytes with this sha256. The
+# processing settings are part of it, so changing them doesn't hand out old images
+def variant_key(sha256, name):
+    size = IMAGE_VARIANTS.get(name, IMAGE_MAX_DIMENSION)
+    return f"{sha256}:{name}:{size}:{IMAGE_FORMAT}:{IMAGE_QUALITY}"
+
+
+# Upload many images in parallel (at most `concurrency` at a time) off the event loop.
+# Returns the urls in the same order as `files` (UploadFile or bytes). Images already on
+# cloudinary (same sha256) are not uploaded again, and identical files in one call are
+# uploaded once. `aliases` (one extra key per file, or None) are remembered for the same
+# upload. If any upload fails the images that this call uploaded are deleted again and
+# ImageUploadError is raised
+async def upload_images(files, concurrency=None, aliases=None):
+    semaphore = asyncio.Semaphore(concurrency or UPLOAD_CONCURRENCY)
+    contents = []
+    for index, file in enumerate(files):
+        try:
+            contents.append(await read_and_hash(file))
+        except Exception as e:
+            raise ImageUploadError(index, e)
+    # sha256 -> index of the first file with those bytes
+    unique = {}
+    for index, (_, sha256) in enumerate(contents):
+        unique.setdefault(sha256, index)
+
+    # returns (cloudinary result, True if it was uploaded by this call). The dedup file is
+    # sqlite, read and written on a worker thread so a busy file never blocks the event loop
+    async def upload_one(index, content, sha256):
+        cached = await anyio.to_thread.run_sync(image_hashes.get, sha256)
+        if cached is not None:
+            return cached, False
+        async with semaphore:
+            try:
+                return await cloudinary_dependency.run_sync(cloudinary_upload, content), True
+            except UpstreamUnavailable:
+                raise
+            except Exception as e:
+                # only an image cloudinary refused is the caller's fault (400), an outage
+                # or a timeout is a 502 / 504
+                if cloudinary_failed(e):
+                    raise UpstreamFailed("cloudinary", e, timed_out=cloudinary_timed_out(e))
+                raise ImageUploadError(index, e)
+
+    results = await asyncio.gather(
+        *(upload_one(index, contents[index][0], sha256) for sha256, index in unique.items()),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        uploaded = [
+            result["public_id"]
+            for result, is_new in (r for r in results if not isinstance(r, BaseException))
+            if is_new
+        ]
+        await asyncio.gather(
+            *(cloudinary_dependency.run_sync(delete_image, public_id) for public_id in uploaded),
+            return_exceptions=True,
+        )
+        raise errors[0]
+    urls = {}
+    uploaded = []
+    by_sha256 = {}
+    for (sha256, index), (result, is_new) in zip(unique.items(), results):
+        if is_new:
+            uploaded.append((sha256, result["secure_url"], result["public_id"], len(contents[index][0])))
+        urls[sha256] = result.get("secure_url")
+        by_sha256[sha256] = result
+    for (content, sha256), alias in zip(contents, aliases or []):
+        if alias is not None:
+            result = by_sha256[sha256]
+            uploaded.append((alias, result["secure_url"], result["public_id"], len(content)))
+    if uploaded:
+        await anyio.to_thread.run_sync(image_hashes.put_many, uploaded)
+    return [urls[sha256] for _, sha256 in contents]
+
+
+# Resize / re-encode every image on the process pool, then upload the result and its
+# variants. Returns one {"url": ..., "variants": {"thumb": ..., "card": ...}} per file,
+# ImageUploadError.index is the position of the file in `files`. The original bytes are
+# hashed while they are read, files processed and uploaded before are not processed again
+async def upload_image_variants(files, concurrency=None):
+    # no point resizing images that can't be uploaded now
+    cloudinary_dependency.breaker.check()
+    names = ["original"] + list(IMAGE_VARIANTS)
+
+    # ({name: url}, None, None) when these bytes were uploaded before, otherwise
+    # (None, processed images, keys to remember their urls under)
+    async def process_one(index, file):
+        try:
+            content, sha256 = await read_and_hash(file)
+            keys = [variant_key(sha256, name) for name in names]
+            known = await anyio.to_thread.run_sync(image_hashes.get_many, keys)
+            if len(known) == len(keys):
+                return {name: known[key]["secure_url"] for name, key in zip(names, keys)}, None, None
+            return None, await process_image_async(content), keys
+        except Exception as e:
+            raise ImageUploadError(index, e)
 
+    prepared = await asyncio.gather(*(process_one(index, file) for index, file in enumerate(files)))
+    pending = [index for index, (known, _, _) in enumerate(prepared) if known is None]
+    try:
+        urls = await upload_images(
+            [prepared[index][1][name] for index in pending for name in names],
+            concurrency,
+            aliases=[key for index in pending for key in prepared[index][2]],
+        )
+    except ImageUploadError as e:
+        raise ImageUploadError(pending[e.index // len(names)], e.error)
+    for position, index in enumerate(pending):
+        start = position * len(names)
+        prepared[index] = (dict(zip(names, urls[start:start + len(names)])), None, None)
+    results = []
+    for urls_of_file, _, _ in prepared:
+        urls_of_file = dict(urls_of_file)
+        results.append({"url": urls_of_file.pop("original"), "variants": urls_of_file})
+    return results
@@ -0,0 +1,104 @@
+import os
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is used without it
+    brotli = None
+
+# Responses smaller than this are sent as they are
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Fast levels, these are dynamic responses compressed on every request
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+# Bodies at least this big are compressed in a worker thread instead of on the event loop
+THREAD_MIN_SIZE = 128 * 1024
+
+
+# Encodings the client accepts with their q value, e.g. "br;q=1.0, gzip;q=0.8"
+def accepted_encodings(header):
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    return accepted
+
+
+# Pick br or gzip (br wins a tie), None when the client accepts neither
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    options = []
+    if brotli is not None:
+        options.append(("br", accepted.get("br", wildcard)))
+    options.append(("gzip", accepted.get("gzip", wildcard)))
+    encoding, q = max(options, key=lambda option: option[1])
+    return encoding if q > 0 else None
+
+
+# Same as starlette's GZipResponder (skips images, small bodies, already encoded
+# responses, flushes per chunk when streaming) with brotli instead of gzip
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size, quality=BROTLI_QUALITY):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    async def apply_compression(self, body, *, more_body):
+        if len(body) >= THREAD_MIN_SIZE:
+            return await anyio.to_thread.run_sync(self._compress_body, body, more_body)
+        return self._compress_body(body, more_body)
+
+    def _compress_body(self, body, more_body):
+        data = self.compressor.process(body)
+        if more_body:
+            return data + self.compressor.flush()
+        return data + self.compressor.finish()
+
+
+# Compress responses with brotli or gzip depending on the client's Accept-Encoding
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding == "br":
+            responder = BrotliResponder(self.app, self.minimum_size)
+        elif encoding == "gzip":
+            responder = GZipResponder(
+                self.app, self.minimum_size, compresslevel=GZIP_LEVEL, thread_minimum_size=THREAD_MIN_SIZE
+            )
+        else:
+            await self.app(scope, receive, send)
+            return
+        await responder(scope, receive, _weak_etag(send))
+
+
+# A compressed body is not byte-for-byte the one the ETag was made for, so the ETag
+# becomes weak (If-None-Match still matches it, see blog_apis.etag_matches)
+def _weak_etag(send):
+    async def wrapped(message):
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(raw=message["headers"])
+            etag = headers.get("etag")
+            if etag and "content-encoding" in headers and not etag.startswith("W/"):
+                headers["etag"] = "W/" + etag
+        await send(message)
+
+    return wrapped
@@ -0,0 +1,39 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from auth import get_current_user, check_admin_or_subadmin
+from application_stats import application_counters, job_counters
+
+#Router for the admin dashboard charts
+dashboard_router = APIRouter(prefix="/dashboard", tags=["dashboard"])
+
+# Longest daily series one request can ask for
+DASHBOARD_MAX_DAYS = 366
+
+
+# admin section Everything the dashboard charts need in one call, served from the
+# in-memory counters: applications by status, applications per job per day, jobs by status
+# e.g. /dashboard/stats?days=30&job_ids=a,b
+@dashboard_router.get("/stats")
+async def dashboard_stats(
+    days: int = Query(30, ge=1, le=DASHBOARD_MAX_DAYS),
+    job_ids: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    try:
+        await check_admin_or_subadmin(user)
+        await asyncio.gather(application_counters.ensure_fresh(), job_counters.ensure_fresh())
+        ids = [job_id.strip() for job_id in job_ids.split(",") if job_id.strip()] if job_ids else None
+        end = datetime.now(timezone.utc).date()
+        start = end - timedelta(days=days - 1)
+        by_status = application_counters.status_counts(ids)
+        return {
+            "applications": {"total": sum(by_status.values()), "by_status": by_status},
+            "daily": application_counters.daily_counts(start, end, ids),
+            "jobs": job_counters.counts(),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error building dashboard stats: {str(e)}")
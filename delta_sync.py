@@ -0,0 +1,101 @@
+import asyncio
+import base64
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from supabase_client import get_supabase
+
+# Tombstones (table_name, row_id, deleted_at) written by the delete endpoints
+DELETED_ROWS_TABLE = "deleted_rows"
+# Changes are handed out once they are this many seconds old. updated_at is set when the
+# transaction starts, so a write that commits after a poll can't be skipped by that poll
+SYNC_SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", "2"))
+# Tombstones older than this may be pruned, older sync tokens get 410 and the client
+# starts over without a token
+SYNC_TOKEN_MAX_AGE_DAYS = float(os.getenv("SYNC_TOKEN_MAX_AGE_DAYS", "30"))
+# sort before / after every uuid, used as the row id of a position that is not a row
+NIL_ID = "00000000-0000-0000-0000-000000000000"
+MAX_ID = "ffffffff-ffff-ffff-ffff-ffffffffffff"
+
+
+# Opaque sync token: the table, the (updated_at, id) of the last changed row and the
+# (deleted_at, row_id) of the last tombstone handed out
+def encode_sync_token(table, changed, deleted):
+    raw = json.dumps([table, changed, deleted], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token, table):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        token_table, changed, deleted = json.loads(base64.urlsafe_b64decode(padded))
+        deleted_at = datetime.fromisoformat(deleted[0])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    if token_table != table:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    if deleted_at < datetime.now(timezone.utc) - timedelta(days=SYNC_TOKEN_MAX_AGE_DAYS):
+        raise HTTPException(status_code=410, detail="Sync token expired, sync again without a token")
+    return changed, deleted
+
+
+# Rows after `position` in (column, id_column) order
+def keyset_after(query, column, id_column, position):
+    value, row_id = position
+    return query.or_(f'{column}.gt."{value}",and({column}.eq."{value}",{id_column}.gt."{row_id}")')
+
+
+# Write tombstones for the rows a delete endpoint removed. The delete already happened,
+# so a failure is only logged, clients that miss it see the row again on a full sync
+async def record_deletes(table, rows):
+    if not rows:
+        return
+    try:
+        await get_supabase().table(DELETED_ROWS_TABLE).insert(
+            [{"table_name": table, "row_id": row["id"]} for row in rows]
+        ).execute()
+    except Exception as e:
+        print(f"Could not record deletes of {table}: {e}")
+
+
+# Rows of `table` created or updated, and ids deleted, since the sync token, oldest first,
+# at most `limit` of each. Without a token every row is returned (page by page) and
+# deletes are tracked from now on. has_more says to call again right away with sync_token
+async def fetch_changes(table, columns, token, limit):
+    bound = (datetime.now(timezone.utc) - timedelta(seconds=SYNC_SETTLE_SECONDS)).isoformat()
+    if token:
+        changed_after, deleted_after = decode_sync_token(token, table)
+    else:
+        changed_after, deleted_after = None, [bound, NIL_ID]
+    if columns != "*" and "updated_at" not in columns.split(","):
+        columns += ",updated_at"
+
+    supabase = get_supabase()
+    changed_query = supabase.table(table).select(columns).lte("updated_at", bound)
+    if changed_after:
+        changed_query = keyset_after(changed_query, "updated_at", "id", changed_after)
+    changed_query = changed_query.order("updated_at").order("id").limit(limit + 1)
+    deleted_query = keyset_after(
+        supabase.table(DELETED_ROWS_TABLE).select("row_id,deleted_at").eq("table_name", table).lte("deleted_at", bound),
+        "deleted_at", "row_id", deleted_after,
+    )
+    deleted_query = deleted_query.order("deleted_at").order("row_id").limit(limit + 1)
+    changed, deleted = await asyncio.gather(changed_query.execute(), deleted_query.execute())
+
+    changed_rows = changed.data[:limit]
+    deleted_rows = deleted.data[:limit]
+    if changed_rows:
+        changed_after = [changed_rows[-1]["updated_at"], changed_rows[-1]["id"]]
+    if len(deleted.data) > limit:
+        deleted_after = [deleted_rows[-1]["deleted_at"], deleted_rows[-1]["row_id"]]
+    else:
+        # every tombstone up to the bound was read, so the token moves up to it. A poller
+        # without deletes keeps a fresh token instead of running into the max age
+        deleted_after = [bound, MAX_ID]
+    return {
+        "changed": changed_rows,
+        "deleted": [row["row_id"] for row in deleted_rows],
+        "sync_token": encode_sync_token(table, changed_after, deleted_after),
+        "has_more": len(changed.data) > limit or len(deleted.data) > limit,
+    }
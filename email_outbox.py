@@ -0,0 +1,254 @@
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from email.mime.text import MIMEText
+from metrics import track
+from resilience import Dependency, UpstreamUnavailable
+
+#smtp server configuration
+smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
+smtp_port = int(os.getenv("SMTP_PORT", "465"))
+smtp_use_ssl = os.getenv("SMTP_USE_SSL", "true").lower() == "true"
+smtp_email = os.getenv("SMTP_EMAIL")
+smtp_password = os.getenv("SMTP_PASSWORD")
+
+# Pending emails are kept in this sqlite file so they survive a restart
+OUTBOX_PATH = os.getenv("EMAIL_OUTBOX_PATH", "email_outbox.db")
+BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "5"))
+RETRY_MAX_SECONDS = float(os.getenv("EMAIL_RETRY_MAX_SECONDS", "600"))
+# The smtp connection is closed after this long without anything to send
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "60"))
+# Rows stuck in "sending" this long (worker crashed mid batch) are picked up again
+SENDING_TIMEOUT_SECONDS = 300
+# Timeout and circuit breaker of the smtp server (resilience.py), SMTP_TIMEOUT /
+# SMTP_BREAKER_FAILURES / SMTP_BREAKER_RESET. While the circuit is open the worker leaves
+# the emails pending instead of using up their attempts. A refused recipient is not the
+# server's fault. The single worker thread is the bulkhead: nothing else waits on smtp
+smtp_dependency = Dependency(
+    "smtp",
+    timeout=15,
+    reset_after=60,
+    is_failure=lambda error: not isinstance(error, smtplib.SMTPRecipientsRefused),
+)
+
+
+# Background worker that sends emails from the outbox table over one persistent smtp connection
+class EmailOutbox:
+    def __init__(self, path=OUTBOX_PATH):
+        self.path = path
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._smtp = None
+        self._last_used = 0.0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._initialized = False
+
+    def _connect_db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # Create the table on first use instead of at import time
+    def _init_db(self):
+        if self._initialized:
+            return
+        with closing(self._connect_db()) as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    to_email TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    claimed_at REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS outbox_due_idx ON outbox (status, next_attempt_at)")
+        self._initialized = True
+
+    # Add one email to the outbox, returns its id
+    def enqueue(self, to_email, subject, body):
+        return self.enqueue_many([(to_email, subject, body)])[0]
+
+    # Add several emails in one transaction, returns their ids
+    def enqueue_many(self, messages):
+        self._init_db()
+        now = time.time()
+        ids = []
+        with closing(self._connect_db()) as db:
+            db.execute("BEGIN")
+            for to_email, subject, body in messages:
+                cursor = db.execute(
+                    "INSERT INTO outbox (to_email, subject, body, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (to_email, subject, body, now, now),
+                )
+                ids.append(cursor.lastrowid)
+            db.execute("COMMIT")
+        self._wakeup.set()
+        return ids
+
+    # Mark the next due emails as "sending" so another worker process won't take them too
+    def _claim_batch(self, db):
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        db.execute(
+            "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+            (now - SENDING_TIMEOUT_SECONDS,),
+        )
+        rows = db.execute(
+            "SELECT id, to_email, subject, body, attempts FROM outbox "
+            "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (now, BATCH_SIZE),
+        ).fetchall()
+        if rows:
+            db.executemany(
+                "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                [(now, row[0]) for row in rows],
+            )
+        db.execute("COMMIT")
+        return rows
+
+    # Seconds until the next pending email is due (or None if nothing is pending)
+    def _next_due_in(self, db):
+        row = db.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()
+        if row[0] is None:
+            return None
+        return max(row[0] - time.time(), 0)
+
+    # Reuse the open smtp connection, reconnect and log in again when it was dropped
+    def _connection(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+                return self._smtp
+            except (smtplib.SMTPException, OSError):
+                self._close_smtp()
+        with track("smtp", "connect"):
+            if smtp_use_ssl:
+                self._smtp = smtplib.SMTP_SSL(smtp_host, smtp_port, timeout=smtp_dependency.timeout)
+            else:
+                self._smtp = smtplib.SMTP(smtp_host, smtp_port, timeout=smtp_dependency.timeout)
+            if smtp_password:
+                self._smtp.login(smtp_email, smtp_password)
+        return self._smtp
+
+    def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+        self._smtp = None
+
+    def _send(self, to_email, subject, body):
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = smtp_email
+        msg["To"] = to_email
+        with smtp_dependency.guard():
+            try:
+                connection = self._connection()
+                with track("smtp", "send"):
+                    connection.sendmail(smtp_email, to_email, msg.as_string())
+            except smtplib.SMTPServerDisconnected:
+                # server closed the connection between noop and send, one fresh try
+                self._close_smtp()
+                connection = self._connection()
+                with track("smtp", "send"):
+                    connection.sendmail(smtp_email, to_email, msg.as_string())
+        self._last_used = time.monotonic()
+
+    # Send one batch, returns how many emails were taken from the outbox
+    def process_batch(self, db):
+        rows = self._claim_batch(db)
+        for message_id, to_email, subject, body, attempts in rows:
+            try:
+                self._send(to_email, subject, body)
+                db.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+                self.sent += 1
+            except UpstreamUnavailable as e:
+                # circuit open, back to pending without using up an attempt
+                db.execute(
+                    "UPDATE outbox SET status = 'pending', next_attempt_at = ? WHERE id = ?",
+                    (time.time() + e.retry_after, message_id),
+                )
+            except Exception as e:
+                attempts += 1
+                self._close_smtp()
+                if attempts >= MAX_ATTEMPTS:
+                    self.failed += 1
+                    status, next_attempt_at = "failed", time.time()
+                else:
+                    # exponential backoff: 5s, 10s, 20s ... up to RETRY_MAX_SECONDS
+                    self.retried += 1
+                    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                    status, next_attempt_at = "pending", time.time() + delay
+                print(f"ERROR sending email {message_id} (attempt {attempts}): {e}")
+                db.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (status, attempts, next_attempt_at, str(e), message_id),
+                )
+        return len(rows)
+
+    def _run(self):
+        self._init_db()
+        db = self._connect_db()
+        try:
+            while not self._stop.is_set():
+                try:
+                    if self.process_batch(db):
+                        continue
+                    wait = self._next_due_in(db)
+                except Exception as e:
+                    print(f"ERROR in email outbox worker: {e}")
+                    wait = RETRY_BASE_SECONDS
+                if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_SECONDS:
+                    self._close_smtp()
+                self._wakeup.wait(SMTP_IDLE_SECONDS if wait is None else min(wait, SMTP_IDLE_SECONDS))
+                self._wakeup.clear()
+        finally:
+            self._close_smtp()
+            db.close()
+
+    # Start the worker thread, called from the app lifespan
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        self._init_db()
+        with closing(self._connect_db()) as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {
+            "pending": counts.get("pending", 0) + counts.get("sending", 0),
+            "failed": counts.get("failed", 0),
+            "sent": self.sent,
+            "retried": self.retried,
+            "running": self._thread is not None,
+        }
+
+
+outbox = EmailOutbox()
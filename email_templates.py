@@ -0,0 +1,83 @@
+import asyncio
+import os
+import re
+import time
+from supabase_client import get_supabase
+
+# Templates are reloaded from the email_templates table after this many seconds
+TEMPLATE_TTL = float(os.getenv("EMAIL_TEMPLATE_TTL", "300"))
+
+
+# The {placeholders} a template can use, any other text (braces included) is sent as it is
+PLACEHOLDERS = ("applicant_name", "job_title", "user_email", "status")
+PLACEHOLDER_RE = re.compile(r"\{(" + "|".join(PLACEHOLDERS) + r")\}")
+
+
+# Split "Hi {applicant_name}, ..." once into literal text and placeholder names
+def compile_text(text):
+    parts = []
+    start = 0
+    for match in PLACEHOLDER_RE.finditer(text):
+        parts.append((text[start:match.start()], match.group(1)))
+        start = match.end()
+    parts.append((text[start:], None))
+    return parts
+
+
+def render_text(parts, values):
+    out = []
+    for literal, field in parts:
+        out.append(literal)
+        if field is not None:
+            value = values.get(field)
+            # placeholders without a value stay visible instead of breaking the email
+            out.append("{" + field + "}" if value is None else str(value))
+    return "".join(out)
+
+
+# Subject and body of one template, ready to render with applicant values
+class CompiledTemplate:
+    def __init__(self, subject, body):
+        self.subject = compile_text(subject)
+        self.body = compile_text(body)
+
+    def render(self, values):
+        return render_text(self.subject, values), render_text(self.body, values)
+
+
+# All email templates kept in memory, keyed by application status
+class TemplateCache:
+    def __init__(self, ttl=TEMPLATE_TTL):
+        self.ttl = ttl
+        self.templates = {}
+        self.loaded_at = None
+        self._lock = asyncio.Lock()
+
+    # Load every template with one query
+    async def load(self):
+        response = await get_supabase().table("email_templates").select("status, subject, body").execute()
+        self.templates = {
+            row["status"]: CompiledTemplate(row["subject"], row["body"]) for row in response.data
+        }
+        self.loaded_at = time.monotonic()
+
+    def _expired(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    async def get(self, status):
+        if self._expired():
+            async with self._lock:
+                if self._expired():
+                    await self.load()
+        return self.templates.get(status)
+
+    # Write a template and update the cache in the same call
+    async def save(self, status, subject, body):
+        await get_supabase().table("email_templates").upsert(
+            {"status": status, "subject": subject, "body": body}
+        ).execute()
+        self.templates[status] = CompiledTemplate(subject, body)
+        return self.templates[status]
+
+
+template_cache = TemplateCache()
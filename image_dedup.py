@@ -0,0 +1,164 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+# sha256 of the image bytes -> cloudinary url, kept in this sqlite file across restarts
+IMAGE_DEDUP_PATH = os.getenv("IMAGE_DEDUP_PATH", "image_dedup.db")
+# Least recently used entries are dropped above this many images
+IMAGE_DEDUP_MAX_ENTRIES = int(os.getenv("IMAGE_DEDUP_MAX_ENTRIES", "50000"))
+READ_CHUNK_SIZE = 64 * 1024
+
+
+# Read an UploadFile (or take raw bytes) and hash it chunk by chunk while reading
+async def read_and_hash(file):
+    digest = hashlib.sha256()
+    if not hasattr(file, "read"):
+        digest.update(file)
+        return file, digest.hexdigest()
+    chunks = []
+    while True:
+        chunk = await file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks), digest.hexdigest()
+
+
+# Content addressed map of images already on cloudinary, so identical bytes are
+# uploaded once and every later upload is answered from the local file
+class ImageHashCache:
+    def __init__(self, path=IMAGE_DEDUP_PATH, max_entries=IMAGE_DEDUP_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def _connect_db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # Create the table on first use instead of at import time
+    def _init_db(self):
+        if self._initialized:
+            return
+        with closing(self._connect_db()) as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS images (
+                    sha256 TEXT PRIMARY KEY,
+                    secure_url TEXT NOT NULL,
+                    public_id TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )"""
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS images_public_id_idx ON images (public_id)")
+            db.execute("CREATE INDEX IF NOT EXISTS images_last_used_idx ON images (last_used_at)")
+        self._initialized = True
+
+    # The stored upload for these bytes, or None
+    def get(self, sha256):
+        self._init_db()
+        with closing(self._connect_db()) as db:
+            row = db.execute(
+                "SELECT secure_url, public_id FROM images WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute("UPDATE images SET last_used_at = ? WHERE sha256 = ?", (time.time(), sha256))
+        self.hits += 1
+        return {"secure_url": row[0], "public_id": row[1]}
+
+    # The stored uploads of several keys in one connection, {key: upload} of those found
+    def get_many(self, keys):
+        self._init_db()
+        found = {}
+        with closing(self._connect_db()) as db:
+            for key in keys:
+                row = db.execute("SELECT secure_url, public_id FROM images WHERE sha256 = ?", (key,)).fetchone()
+                if row is not None:
+                    found[key] = {"secure_url": row[0], "public_id": row[1]}
+            if found:
+                now = time.time()
+                db.executemany("UPDATE images SET last_used_at = ? WHERE sha256 = ?", [(now, key) for key in found])
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, sha256, secure_url, public_id, size):
+        self.put_many([(sha256, secure_url, public_id, size)])
+
+    # Store several (sha256, secure_url, public_id, size) entries in one transaction
+    def put_many(self, entries):
+        self._init_db()
+        now = time.time()
+        with self._lock, closing(self._connect_db()) as db:
+            db.execute("BEGIN")
+            db.executemany(
+                "INSERT OR REPLACE INTO images (sha256, secure_url, public_id, size, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(sha256, secure_url, public_id, size, now, now) for sha256, secure_url, public_id, size in entries],
+            )
+            self._evict(db)
+            db.execute("COMMIT")
+
+    # Drop the least recently used entries above max_entries
+    def _evict(self, db):
+        count = db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        extra = count - self.max_entries
+        if extra > 0:
+            db.execute(
+                "DELETE FROM images WHERE sha256 IN (SELECT sha256 FROM images ORDER BY last_used_at LIMIT ?)",
+                (extra,),
+            )
+            self.evicted += extra
+
+    # Forget an asset that was deleted from cloudinary
+    def forget(self, public_id):
+        self._init_db()
+        with closing(self._connect_db()) as db:
+            db.execute("DELETE FROM images WHERE public_id = ?", (public_id,))
+
+    # Drop entries whose asset no longer exists. exists(public_ids) returns the ids of
+    # that batch still on cloudinary, so assets deleted from the cloudinary console
+    # (or by another service) stop being handed out
+    def reconcile(self, exists, batch_size=100):
+        self._init_db()
+        with closing(self._connect_db()) as db:
+            public_ids = [row[0] for row in db.execute("SELECT DISTINCT public_id FROM images")]
+        removed = 0
+        for start in range(0, len(public_ids), batch_size):
+            batch = public_ids[start:start + batch_size]
+            missing = set(batch) - set(exists(batch))
+            for public_id in missing:
+                self.forget(public_id)
+            removed += len(missing)
+        return {"checked": len(public_ids), "removed": removed}
+
+    def stats(self):
+        self._init_db()
+        with closing(self._connect_db()) as db:
+            count, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": count,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evicted": self.evicted,
+        }
+
+
+image_hashes = ImageHashCache()
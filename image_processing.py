@@ -0,0 +1,104 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Images are downsized so the longest side is at most this many pixels
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "2048"))
+# "webp" or "jpeg"
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp").lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "82"))
+# Extra sizes made from every image, name:longest side, e.g. "thumb:320,card:800"
+IMAGE_VARIANTS = {
+    name.strip(): int(size)
+    for name, size in (
+        item.split(":") for item in os.getenv("IMAGE_VARIANTS", "thumb:320,card:800").split(",") if item.strip()
+    )
+}
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Camera images can be huge, refuse anything above this many pixels instead of decoding it
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(60_000_000)))
+
+# Process pool for decoding / resizing, created by start_pool() in the app lifespan
+process_pool = None
+
+
+def _encode(image, fmt, quality):
+    out = io.BytesIO()
+    if fmt == "jpeg":
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        image.save(out, "WEBP", quality=quality, method=4)
+    return out.getvalue()
+
+
+def _resized(image, size):
+    from PIL import Image
+
+    copy = image.copy()
+    copy.thumbnail((size, size), Image.LANCZOS)
+    return copy
+
+
+# Runs in a worker process: returns {"original": bytes, "<variant>": bytes, ...}.
+# Orientation from EXIF is applied to the pixels, everything else in the metadata
+# (EXIF, GPS, comments, ICC text chunks) is dropped by re-encoding only the pixels.
+# Pillow is imported on first use, in the pool workers, so the app process boots without it
+def process_image(content, max_dimension=IMAGE_MAX_DIMENSION, fmt=IMAGE_FORMAT,
+                  quality=IMAGE_QUALITY, variants=None):
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    variants = IMAGE_VARIANTS if variants is None else variants
+    with Image.open(io.BytesIO(content)) as source:
+        # Pillow only raises above twice MAX_IMAGE_PIXELS (and warns below that), the
+        # size is known from the header so nothing has been decoded yet
+        width, height = source.size
+        if width * height > IMAGE_MAX_PIXELS:
+            raise ValueError(f"Image is too large ({width}x{height} pixels, at most {IMAGE_MAX_PIXELS})")
+        source.seek(0)  # first frame of animated images
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    result = {"original": _encode(image, fmt, quality)}
+    for name, size in variants.items():
+        result[name] = _encode(_resized(image, size), fmt, quality)
+    return result
+
+
+def start_pool():
+    global process_pool
+    if process_pool is None:
+        # spawn: the app runs threads (email outbox), forking them is not safe
+        process_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+
+
+def stop_pool():
+    global process_pool
+    if process_pool is not None:
+        process_pool.shutdown(wait=True, cancel_futures=True)
+        process_pool = None
+
+
+# Process one image on the pool (or in a thread when the pool was not started)
+async def process_image_async(content):
+    global process_pool
+    loop = asyncio.get_running_loop()
+    pool = process_pool
+    try:
+        return await loop.run_in_executor(pool, process_image, content)
+    except BrokenProcessPool:
+        # a worker died (e.g. killed for memory), replace the pool and try once more
+        if pool is not None and process_pool is pool:
+            process_pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            start_pool()
+        return await loop.run_in_executor(process_pool, process_image, content)
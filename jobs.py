@@ -1,26 +1,55 @@
-from fastapi import FastAPI,APIRouter, HTTPException, Depends
-from supabase import create_client, Client
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from typing import Optional
+from supabase_client import get_supabase
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_fields, fetch_page
+from response_models import Job, JobChanges
+from typing import List
 import os
-from dotenv import load_dotenv
 from auth import get_current_user, check_admin_or_subadmin
+from application_stats import application_counters, job_counters
+from cache_utils import SingleFlight
+from delta_sync import fetch_changes, record_deletes
 
 #Job router to route job apis
 jobs_router = APIRouter(prefix="/jobs", tags=["jobs"])
 
-load_dotenv()
+# Columns the list endpoint can project with ?fields=
+JOB_FIELDS = {
+    "title": "title",
+    "department": "department",
+    "employment_type": "employment_type",
+    "job_description": "job_description",
+    "qualifications": "qualifications",
+    "salary_range": "salary_range",
+    "location": "location",
+    "status": "status",
+}
 
-app = FastAPI()
-#supaabase connection
-supabase = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+# Concurrent identical reads share one supabase call. The *_MAX_AGE / *_STALE settings
+# (seconds, 0 = off) also keep the last result: served as is for MAX_AGE, then for STALE
+# more seconds while one background call refreshes it. Every job write drops them
+jobs_list_flight = SingleFlight(
+    "GET /jobs/jobs",
+    max_age=float(os.getenv("JOBS_LIST_MAX_AGE", "0")),
+    stale=float(os.getenv("JOBS_LIST_STALE", "0")),
 )
+job_flight = SingleFlight(
+    "GET /jobs/jobs/{job_id}",
+    max_age=float(os.getenv("JOB_MAX_AGE", "0")),
+    stale=float(os.getenv("JOB_STALE", "0")),
+)
+
+
+def jobs_changed():
+    jobs_list_flight.clear()
+    job_flight.clear()
+
 #Create job api
-@jobs_router.post("/")
-def create_job(job: dict, user=Depends(get_current_user)):
+@jobs_router.post("/", response_model=List[Job])
+async def create_job(job: dict, user=Depends(get_current_user)):
  try:
-    check_admin_or_subadmin(user)
-    response = supabase.table("jobs").insert({
+    await check_admin_or_subadmin(user)
+    response = await get_supabase().table("jobs").insert({
         "title": job["title"],  # job title
         "department": job["department"],
         "employment_type": job["emp_type"],  # job summary
@@ -30,6 +59,9 @@ def create_job(job: dict, user=Depends(get_current_user)):
         "location": job["location"],  # optional
         "status": "live"  # default state live
     }).execute()
+    for row in response.data:
+        job_counters.added(row)
+    jobs_changed()
     return response.data
  #use exception
  except HTTPException:
@@ -38,29 +70,58 @@ def create_job(job: dict, user=Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"Error deleting blog: {str(e)}")
 
 #Get one api
-@jobs_router.get("/jobs/{job_id}")
-def get_job(job_id: str):
+@jobs_router.get("/jobs/{job_id}", response_model=List[Job])
+async def get_job(job_id: str):
 
-    response = supabase.table("jobs").select("*").eq("id", job_id).execute()
-    return response.data
+    async def load():
+        response = await get_supabase().table("jobs").select("*").eq("id", job_id).execute()
+        return response.data
 
-#Get all jobs api
-@jobs_router.get("/jobs")
-def get_all_jobs():
- 
-    response = supabase.table("jobs").select("*").execute()
-    return response.data
+    return await job_flight.run(job_id, load)
+
+#Get all jobs api, one page at a time
+#body stays a list, the cursor for the next page is sent in the X-Next-Cursor header
+@jobs_router.get("/jobs", response_model=List[Job], response_model_exclude_unset=True)
+async def get_all_jobs(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    async def load():
+        query = get_supabase().table("jobs").select(parse_fields(fields, JOB_FIELDS))
+        return await fetch_page(query, cursor, limit)
+
+    jobs, next_cursor = await jobs_list_flight.run((limit, cursor, fields), load)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return jobs
+
+#admin section Jobs created, updated or deleted since ?since= (the sync_token of the previous
+#call, none for a first full sync). Call again with the new token while has_more
+@jobs_router.get("/sync", response_model=JobChanges, response_model_exclude_unset=True)
+async def sync_jobs(
+    since: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    await check_admin_or_subadmin(user)
+    return await fetch_changes("jobs", parse_fields(fields, JOB_FIELDS), since, limit)
  
 #jobs update api
-@jobs_router.put("/{job_id}")
-def update_job(job_id, job: dict, user=Depends(get_current_user)):
+@jobs_router.put("/{job_id}", response_model=List[Job])
+async def update_job(job_id, job: dict, user=Depends(get_current_user)):
  try:
-    check_admin_or_subadmin(user)
+    await check_admin_or_subadmin(user)
 
-    response = supabase.table("jobs").update(job).eq("id", job_id).execute()
+    response = await get_supabase().table("jobs").update(job).eq("id", job_id).execute()
     
     if not response.data:
         raise HTTPException(status_code=404, detail="Job not found")
+    for row in response.data:
+        job_counters.updated(row)
+    jobs_changed()
 
     return response.data
  except HTTPException:
@@ -70,10 +131,13 @@ def update_job(job_id, job: dict, user=Depends(get_current_user)):
 
 #jobs close api
 @jobs_router.patch("/{job_id}/close")
-def close_job(job_id, user=Depends(get_current_user)):
+async def close_job(job_id, user=Depends(get_current_user)):
  try:
-    check_admin_or_subadmin(user)
-    response = supabase.table("jobs").update({"status": "closed"}).eq("id", job_id).execute()
+    await check_admin_or_subadmin(user)
+    response = await get_supabase().table("jobs").update({"status": "closed"}).eq("id", job_id).execute()
+    for row in response.data:
+        job_counters.updated(row)
+    jobs_changed()
     return {"message": "Job closed successfully"}
  except HTTPException:
   raise
@@ -82,11 +146,16 @@ def close_job(job_id, user=Depends(get_current_user)):
 
 #delete job api
 @jobs_router.delete("/{job_id}")
-def delete_job(job_id, user=Depends(get_current_user)):
+async def delete_job(job_id, user=Depends(get_current_user)):
  try:
-    check_admin_or_subadmin(user)
+    await check_admin_or_subadmin(user)
 
-    response = supabase.table("jobs").delete().eq("id", job_id).execute()
+    response = await get_supabase().table("jobs").delete().eq("id", job_id).execute()
+    for row in response.data:
+        job_counters.removed(row)
+        application_counters.job_removed(row["id"])
+    jobs_changed()
+    await record_deletes("jobs", response.data)
     
     return {"message": "Job deleted successfully"}
  except HTTPException:
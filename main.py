@@ -1,20 +1,95 @@
+# Read .env once, before the modules below read their settings from the environment
+from dotenv import load_dotenv
+
+load_dotenv()
+
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.security import HTTPBearer
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from supabase import create_client
+from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import httpx
 import os
-from dotenv import load_dotenv
-from blog_apis import blog_router  # Import routers
+from blog_apis import blog_router, ensure_blog_indexes  # Import routers
 from jobs import jobs_router
 from automated_email import email_router
-from applicant_job_apply import jobapply_router
-from auth import get_current_user, check_admin_or_subadmin
-import time
+from applicant_job_apply import jobapply_router, RESUME_MAX_BYTES
+from auth import (
+    get_current_user,
+    check_admin_or_subadmin,
+    load_jwt_keys,
+    auth_cache_stats,
+    get_user_role,
+    get_user_roles,
+    set_user_role,
+    invalidate_user_role,
+)
+from clients import clients
+from supabase_client import get_auth_client
+from email_outbox import outbox
+from email_templates import template_cache
+from application_stats import application_counters, job_counters
+from dashboard import dashboard_router
+from image_processing import start_pool, stop_pool
+from compression import CompressionMiddleware
+from metrics import metrics, TimingMiddleware
+from cache_utils import single_flights
+from resilience import dependency_stats
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager
 import traceback
 
-app = FastAPI()
+
+# "background": the worker serves requests while the clients and caches below are being
+# set up, "blocking": startup waits for them
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+
+
+# Everything here is also done on first use, so a request that comes in early (or
+# after a failed step) only waits for what it needs
+async def warm_up():
+    # import the supabase / cloudinary SDKs off the event loop and build the shared clients
+    await clients.warm_up()
+    # jwt secret / JWKS for local token verification
+    await load_jwt_keys()
+    steps = (
+        # email templates are compiled once and refreshed on TTL / change
+        ("email templates", template_cache.load),
+        # applicant counters, updated incrementally by the application handlers
+        ("applicant counts", application_counters.ensure_fresh),
+        # live / closed job counts for the dashboard, updated by the job handlers
+        ("job counts", job_counters.ensure_fresh),
+        # in-memory search and tag/category indexes over the blogs, updated by the blog write handlers
+        ("blog indexes", ensure_blog_indexes),
+    )
+    for name, step in steps:
+        try:
+            await step()
+        except Exception as e:
+            print(f"Could not load {name}, will retry on first use: {e}")
+
+
+# Things that should be set up once when the server starts
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up_task = asyncio.create_task(warm_up())
+    if STARTUP_WARMUP == "blocking":
+        await warm_up_task
+    # worker processes that resize images before they go to cloudinary (started on first use)
+    start_pool()
+    # background worker that sends queued emails
+    outbox.start()
+    yield
+    warm_up_task.cancel()
+    await asyncio.gather(warm_up_task, return_exceptions=True)
+    outbox.stop()
+    stop_pool()
+    await clients.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Cors for giving access to frontend access
 origins = [
@@ -31,6 +106,18 @@ origins = [
     "https://mehditech-admin-dashboard-backend-production.up.railway.app",
 ]
 
+# Reject job applications whose body is bigger than the resume limit before reading it
+# (the form fields around the file get some extra room). Added before CORS so CORS wraps
+# it and the 413 carries the CORS headers
+@app.middleware("http")
+async def upload_size_middleware(request: Request, call_next):
+    if request.method == "POST" and request.url.path.startswith("/jobapply/job_apply/"):
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > RESUME_MAX_BYTES + 64 * 1024:
+            return JSONResponse(status_code=413, content={"detail": "Resume is too large"})
+    return await call_next(request)
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -40,6 +127,9 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# brotli / gzip for large responses, picked from the client's Accept-Encoding
+app.add_middleware(CompressionMiddleware)
+
 
 # Add middleware to handle proxy headers (HTTPS)
 @app.middleware("http")
@@ -50,7 +140,20 @@ async def proxy_middleware(request: Request, call_next):
     return await call_next(request)
 
 
+# Request latency per route, outermost so it sees the full time of every request
+app.add_middleware(TimingMiddleware)
+
+
 # Global exception handler to ensure CORS headers on errors
+# CORS headers for error responses built by the handlers below
+def cors_error_headers(request: Request):
+    return {
+        "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
+        "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS, PATCH",
+        "Access-Control-Allow-Headers": "Content-Type, Authorization",
+    }
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     # Log the error for debugging
@@ -62,30 +165,31 @@ async def global_exception_handler(request: Request, exc: Exception):
     return JSONResponse(
         status_code=500,
         content={"detail": str(exc)},
-        headers={
-            "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
-            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS, PATCH",
-            "Access-Control-Allow-Headers": "Content-Type, Authorization",
-        },
+        headers=cors_error_headers(request),
     )
 
 
-load_dotenv()
+# httpx timeouts / connection errors that no router turned into an HTTPException (calls
+# outside the guarded supabase transport) are an upstream problem, not a 500 of ours
+@app.exception_handler(httpx.TransportError)
+async def upstream_exception_handler(request: Request, exc: httpx.TransportError):
+    print(f"Upstream error on {request.url.path}: {exc!r}")
+    if isinstance(exc, httpx.TimeoutException):
+        status_code, detail = 504, "Upstream service timed out, try again later"
+    else:
+        status_code, detail = 503, "Upstream service unavailable, try again later"
+    return JSONResponse(status_code=status_code, content={"detail": detail}, headers=cors_error_headers(request))
+
 
 # Get blog routes
 app.include_router(blog_router)
 app.include_router(jobs_router)
 app.include_router(email_router)
 app.include_router(jobapply_router)
+app.include_router(dashboard_router)
 # Security
 security = HTTPBearer()
 
-# Connect with supabase
-supabase = create_client(
-    os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-)
-
-
 # signup and login request body to receive data
 class SignupRequest(BaseModel):
     email: str
@@ -99,8 +203,8 @@ class LoginRequest(BaseModel):
 
 # api for signup
 @app.post("/signup")
-def signup(data: SignupRequest):
-    auth_response = supabase.auth.sign_up(
+async def signup(data: SignupRequest):
+    auth_response = await get_auth_client().sign_up(
         {  # Create user in supabase auth
             "email": data.email,
             "password": data.password,
@@ -116,8 +220,8 @@ def signup(data: SignupRequest):
 
 # api for login
 @app.post("/login")
-def login(data: LoginRequest):
-    auth_response = supabase.auth.sign_in_with_password(
+async def login(data: LoginRequest):
+    auth_response = await get_auth_client().sign_in_with_password(
         {  # Authenticate user
             "email": data.email,
             "password": data.password,
@@ -129,10 +233,7 @@ def login(data: LoginRequest):
 
     # Get user role from supabase
     user = auth_response.user
-    role_data = (
-        supabase.table("user_roles").select("role").eq("user_id", user.id).execute()
-    )
-    role = role_data.data[0]["role"] if role_data.data else "user"
+    role = await get_user_role(user.id) or "user"
 
     # return jwt token
     return {
@@ -145,18 +246,13 @@ def login(data: LoginRequest):
 
 # admin api call after logged in
 @app.get("/admin")  # first get get_current_user to verify token
-def admin_dashboard(user=Depends(get_current_user)):
+async def admin_dashboard(user=Depends(get_current_user)):
     try:
-        # Fetch and check user role from user_roles table
-        role_data = (
-            supabase.table("user_roles")
-            .select("role")
-            .eq("user_id", user.user.id)
-            .execute()
-        )
+        # Fetch and check user role from the shared role cache
+        role = await get_user_role(user.user.id)
 
         # if no role is found
-        if role_data.data[0]["role"] != "admin":
+        if role != "admin":
             raise HTTPException(status_code=403, detail="Access for Admins only")
 
         return {"message": "Welcome to the admin dashboard"}
@@ -166,6 +262,75 @@ def admin_dashboard(user=Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"Error getting admin: {str(e)}")
 
 
+class RoleRequest(BaseModel):
+    role: str
+
+
+# Look up the roles of many users at once, e.g. /admin/roles?user_ids=a,b,c
+@app.get("/admin/roles")
+async def list_user_roles(user_ids: str, user=Depends(get_current_user)):
+    await check_admin_or_subadmin(user)
+    ids = [user_id.strip() for user_id in user_ids.split(",") if user_id.strip()]
+    return {"roles": await get_user_roles(ids)}
+
+
+# Assign a role, the role cache is updated together with the table
+@app.put("/admin/roles/{user_id}")
+async def assign_user_role(user_id: str, data: RoleRequest, user=Depends(get_current_user)):
+    if await get_user_role(user.user.id) != "admin":
+        raise HTTPException(status_code=403, detail="Access for Admins only")
+    if data.role not in ["admin", "subadmin", "user"]:
+        raise HTTPException(status_code=400, detail="Invalid role")
+    try:
+        await set_user_role(user_id, data.role)
+        return {"message": "Role updated successfully", "role": data.role}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating role: {str(e)}")
+
+
+# Forget cached roles after user_roles was edited outside this api (e.g. in the supabase
+# dashboard), ?user_id= for one user, otherwise all. Only clears this worker's cache
+@app.delete("/admin/roles/cache")
+async def clear_role_cache(user_id: Optional[str] = None, user=Depends(get_current_user)):
+    if await get_user_role(user.user.id) != "admin":
+        raise HTTPException(status_code=403, detail="Access for Admins only")
+    invalidate_user_role(user_id)
+    return {"message": "Role cache cleared"}
+
+
+# Prometheus metrics: request latency per route and latency of supabase / cloudinary / smtp.
+# Set METRICS_TOKEN to require "Authorization: Bearer <token>" from the scraper
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(request: Request):
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# token and role cache hit/miss counters
+@app.get("/auth/stats")
+async def auth_stats(user=Depends(get_current_user)):
+    await check_admin_or_subadmin(user)
+    return auth_cache_stats()
+
+
+# per route: calls, upstream calls made, calls coalesced into one in flight,
+# and calls served from a kept result (fresh / stale)
+@app.get("/coalescing/stats")
+async def coalescing_stats(user=Depends(get_current_user)):
+    await check_admin_or_subadmin(user)
+    return {name: flight.stats() for name, flight in single_flights.items()}
+
+
+# per upstream: timeout, circuit state, failures in a row, times opened, calls refused
+# while open, and bulkhead use
+@app.get("/upstreams/stats")
+async def upstream_stats(user=Depends(get_current_user)):
+    await check_admin_or_subadmin(user)
+    return dependency_stats()
+
+
 # #Get user profile
 # @app.get("/profile")
 # def get_profile(user=Depends(get_current_user)):
@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+import httpx
+from cache_utils import single_flights
+from resilience import dependencies
+
+# Histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Add a Server-Timing header with the upstream split to every response
+SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "false").lower() == "true"
+
+# Seconds spent per upstream by the current request, set by TimingMiddleware.
+# anyio.to_thread (also behind run_in_threadpool and the bulkheads) copies the context, so calls made from worker threads count too
+request_upstreams = ContextVar("request_upstreams", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+# In-process metrics, written by the request middleware, the supabase transport,
+# cloudinary_utils and the email outbox thread
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # (method, route, status) -> Histogram
+        self.upstreams = {}  # (upstream, operation) -> Histogram
+        self.upstream_errors = {}  # (upstream, operation) -> count
+        self.request_upstream_seconds = {}  # (route, upstream) -> seconds
+
+    def observe_request(self, method, route, status, seconds, upstreams):
+        with self._lock:
+            key = (method, route, str(status))
+            if key not in self.requests:
+                self.requests[key] = Histogram()
+            self.requests[key].observe(seconds)
+            for upstream, upstream_seconds in upstreams.items():
+                key = (route, upstream)
+                self.request_upstream_seconds[key] = self.request_upstream_seconds.get(key, 0.0) + upstream_seconds
+
+    def observe_upstream(self, upstream, operation, seconds, error=False):
+        with self._lock:
+            key = (upstream, operation)
+            if key not in self.upstreams:
+                self.upstreams[key] = Histogram()
+            self.upstreams[key].observe(seconds)
+            if error:
+                self.upstream_errors[key] = self.upstream_errors.get(key, 0) + 1
+        spent = request_upstreams.get()
+        if spent is not None:
+            spent[upstream] = spent.get(upstream, 0.0) + seconds
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self._lock:
+            _histogram_lines(
+                lines, "http_request_duration_seconds", "Request latency per route",
+                ("method", "route", "status"), self.requests,
+            )
+            _histogram_lines(
+                lines, "upstream_request_duration_seconds", "Latency of calls to supabase, cloudinary and smtp",
+                ("upstream", "operation"), self.upstreams,
+            )
+            lines.append("# HELP upstream_request_errors_total Failed calls per upstream")
+            lines.append("# TYPE upstream_request_errors_total counter")
+            for key, count in sorted(self.upstream_errors.items()):
+                lines.append(f"upstream_request_errors_total{_labels(('upstream', 'operation'), key)} {count}")
+            lines.append("# HELP http_request_upstream_seconds_total Time requests of a route spent waiting on each upstream")
+            lines.append("# TYPE http_request_upstream_seconds_total counter")
+            for key, seconds in sorted(self.request_upstream_seconds.items()):
+                lines.append(f"http_request_upstream_seconds_total{_labels(('route', 'upstream'), key)} {seconds:.6f}")
+        lines.append("# HELP read_coalescing_calls_total Coalesced reads per route by outcome")
+        lines.append("# TYPE read_coalescing_calls_total counter")
+        for name, flight in sorted(single_flights.items()):
+            for outcome in ("upstream", "coalesced", "fresh", "stale", "errors"):
+                lines.append(f"read_coalescing_calls_total{_labels(('route', 'outcome'), (name, outcome))} {flight.counts[outcome]}")
+        lines.append("# HELP upstream_circuit_open Whether the circuit breaker of the upstream refuses calls (1) or not (0)")
+        lines.append("# TYPE upstream_circuit_open gauge")
+        for name, dependency in sorted(dependencies.items()):
+            lines.append(f"upstream_circuit_open{_labels(('upstream',), (name,))} {int(dependency.breaker.state == 'open')}")
+        lines.append("# HELP upstream_rejected_total Calls refused without reaching the upstream")
+        lines.append("# TYPE upstream_rejected_total counter")
+        for name, dependency in sorted(dependencies.items()):
+            lines.append(f"upstream_rejected_total{_labels(('upstream', 'reason'), (name, 'circuit_open'))} {dependency.breaker.rejected}")
+            if dependency.bulkhead is not None:
+                lines.append(f"upstream_rejected_total{_labels(('upstream', 'reason'), (name, 'bulkhead_full'))} {dependency.bulkhead.rejected}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+def _histogram_lines(lines, name, help_text, label_names, histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+            cumulative += count
+            le = 'le="' + str(bound) + '"'
+            lines.append(f"{name}_bucket{_labels(label_names, key, le)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(label_names, key)} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{_labels(label_names, key)} {histogram.count}")
+
+
+metrics = Metrics()
+
+
+# Time a blocking call to an upstream:  with track("cloudinary", "upload"): ...
+@contextmanager
+def track(upstream, operation):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        metrics.observe_upstream(upstream, operation, time.perf_counter() - start, error)
+
+
+# /rest/v1/blogs -> ("supabase_rest", "GET blogs"), /storage/v1/object/... -> ("supabase_storage", "POST object")
+def classify_supabase(request):
+    parts = request.url.path.strip("/").split("/")
+    service = {"rest": "supabase_rest", "auth": "supabase_auth", "storage": "supabase_storage"}.get(
+        parts[0], "supabase_other"
+    )
+    resource = parts[2] if len(parts) > 2 else ""
+    return service, f"{request.method} {resource}"
+
+
+# httpx transport that times every supabase call (database, auth and storage share the client)
+class TimedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        upstream, operation = classify_supabase(request)
+        start = time.perf_counter()
+        error = True
+        try:
+            response = await self.transport.handle_async_request(request)
+            error = response.status_code >= 500
+            return response
+        finally:
+            metrics.observe_upstream(upstream, operation, time.perf_counter() - start, error)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+# Records request latency per route template (/blogs/{blog_id}, not the real id) and,
+# when METRICS_SERVER_TIMING is on, adds a Server-Timing header such as
+#   Server-Timing: app;dur=41.2, supabase_rest;dur=35.0, cloudinary;dur=0.0
+# The header is sent with the first byte, for streamed responses it covers the time until then
+class TimingMiddleware:
+    def __init__(self, app, server_timing=SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        upstreams = {}
+        token = request_upstreams.set(upstreams)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    elapsed = (time.perf_counter() - start) * 1000
+                    entries = [f"app;dur={elapsed:.1f}"] + [
+                        f"{name};dur={seconds * 1000:.1f}" for name, seconds in upstreams.items()
+                    ]
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", ", ".join(entries).encode())
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_upstreams.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            metrics.observe_request(scope["method"], route_path, status, time.perf_counter() - start, upstreams)
@@ -0,0 +1,57 @@
+import base64
+import json
+from fastapi import HTTPException
+
+# page size used when the client does not send ?limit=
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+# Opaque cursor: the (created_at, id) of the last row of the page
+def encode_cursor(row):
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return str(created_at), str(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# Turn ?fields=title,author into a select string, id and created_at are always
+# selected because the next cursor is built from them
+def parse_fields(fields, allowed, default="*"):
+    if not fields:
+        return default
+    selected = ["id", "created_at"]
+    for field in fields.split(","):
+        field = field.strip()
+        if not field or field in selected:
+            continue
+        if field not in allowed:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {field}")
+        selected.append(allowed[field])
+    return ",".join(selected)
+
+
+# Order by (created_at, id) and continue after the cursor row
+def apply_keyset(query, cursor, desc=True):
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        op = "lt" if desc else "gt"
+        query = query.or_(
+            f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}."{row_id}")'
+        )
+    return query.order("created_at", desc=desc).order("id", desc=desc)
+
+
+# Fetch one row more than the limit to know if there is a next page
+async def fetch_page(query, cursor, limit, desc=True):
+    response = await apply_keyset(query, cursor, desc).limit(limit + 1).execute()
+    rows = response.data
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
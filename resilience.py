@@ -0,0 +1,291 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+import anyio
+import anyio.to_thread
+import httpx
+from fastapi import HTTPException
+
+# Every Dependency by name, for the stats endpoint and /metrics
+dependencies = {}
+
+
+# Raised instead of calling a dependency whose circuit is open or whose bulkhead is full.
+# It is an HTTPException (503 with Retry-After), so the routers' `except HTTPException: raise`
+# hands it to the client as it is
+class UpstreamUnavailable(HTTPException):
+    def __init__(self, upstream, reason, retry_after):
+        self.upstream = upstream
+        self.retry_after = max(retry_after, 1)
+        super().__init__(
+            status_code=503,
+            detail=f"{upstream} is unavailable ({reason}), try again later",
+            headers={"Retry-After": str(math.ceil(self.retry_after))},
+        )
+
+
+# Raised when a call to a dependency failed (502) or ran out of its timeout budget (504).
+# An HTTPException like UpstreamUnavailable, so a broken upstream is not reported as a
+# bad request or a bug of ours
+class UpstreamFailed(HTTPException):
+    def __init__(self, upstream, error, timed_out=False):
+        self.upstream = upstream
+        self.error = error
+        if timed_out:
+            super().__init__(status_code=504, detail=f"{upstream} timed out, try again later")
+        else:
+            super().__init__(status_code=502, detail=f"{upstream} failed: {error}")
+
+
+# Stops calling a dependency after `failures` failed calls in a row (open). After
+# `reset_after` seconds one trial call goes through (half open): success closes the
+# circuit, failure opens it again. is_failure(error) tells dependency failures from
+# errors of the request itself (e.g. a rejected image), which count as success.
+# Used from the event loop and from worker threads
+class CircuitBreaker:
+    def __init__(self, name, failures=5, reset_after=30.0, is_failure=None):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_after = reset_after
+        self.is_failure = is_failure or (lambda error: True)
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _retry_after(self):
+        return self._opened_at + self.reset_after - time.monotonic()
+
+    # Raise while calls are refused, without taking the half-open trial
+    def check(self):
+        with self._lock:
+            if self.state == "closed" or (self.state == "open" and self._retry_after() <= 0):
+                return
+            if self.state == "half_open" and not self._trial:
+                return
+            self.rejected += 1
+            retry_after = self._retry_after()
+        raise UpstreamUnavailable(self.name, "circuit open", retry_after)
+
+    # Raise while calls are refused, otherwise the caller makes the call and reports
+    # back with success(), failure() or release()
+    def before_call(self):
+        with self._lock:
+            if self.state == "open" and self._retry_after() <= 0:
+                self.state = "half_open"
+            if self.state == "closed":
+                return
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return
+            self.rejected += 1
+            retry_after = self._retry_after()
+        raise UpstreamUnavailable(self.name, "circuit open", retry_after)
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = "closed"
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._trial = False
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    # The call ended without telling anything about the dependency (cancelled)
+    def release(self):
+        with self._lock:
+            self._trial = False
+
+    # with breaker.guard(): call the dependency
+    @contextmanager
+    def guard(self):
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            if self.is_failure(e):
+                self.failure()
+            else:
+                self.success()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.success()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+# At most `limit` concurrent calls to one dependency. A call waits up to `wait` seconds
+# for a slot and then fails with UpstreamUnavailable instead of queueing forever. Blocking
+# calls run on threads of the bulkhead's own limiter, not the shared threadpool
+class Bulkhead:
+    def __init__(self, name, limit, wait=5.0):
+        self.name = name
+        self.limit = limit
+        self.wait = wait
+        self.active = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(limit)
+        self.limiter = anyio.CapacityLimiter(limit)
+
+    async def acquire(self):
+        try:
+            async with asyncio.timeout(self.wait):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            self.rejected += 1
+            raise UpstreamUnavailable(self.name, "too many concurrent calls", self.wait)
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def stats(self):
+        return {"active": self.active, "limit": self.limit, "rejected": self.rejected}
+
+
+# Timeout budget, circuit breaker and (optionally) bulkhead of one external dependency.
+# Every setting can be overridden with <NAME>_<SETTING> env vars, e.g. CLOUDINARY_TIMEOUT,
+# CLOUDINARY_CONCURRENCY, CLOUDINARY_BULKHEAD_WAIT, CLOUDINARY_BREAKER_FAILURES, CLOUDINARY_BREAKER_RESET
+class Dependency:
+    def __init__(self, name, timeout, concurrency=None, wait=5.0, failures=5, reset_after=30.0, is_failure=None):
+        prefix = name.upper()
+        self.name = name
+        self.timeout = float(os.getenv(f"{prefix}_TIMEOUT", timeout))
+        self.breaker = CircuitBreaker(
+            name,
+            failures=int(os.getenv(f"{prefix}_BREAKER_FAILURES", failures)),
+            reset_after=float(os.getenv(f"{prefix}_BREAKER_RESET", reset_after)),
+            is_failure=is_failure,
+        )
+        concurrency = int(os.getenv(f"{prefix}_CONCURRENCY", concurrency or 0))
+        self.bulkhead = (
+            Bulkhead(name, concurrency, float(os.getenv(f"{prefix}_BULKHEAD_WAIT", wait))) if concurrency else None
+        )
+        dependencies[name] = self
+
+    # Run a blocking call in a thread of this dependency's bulkhead. Fails fast while the
+    # circuit is open, the call itself should use guard() to report how it went
+    async def run_sync(self, function, *args):
+        self.breaker.check()
+        async with self.bulkhead:
+            return await anyio.to_thread.run_sync(function, *args, limiter=self.bulkhead.limiter)
+
+    def guard(self):
+        return self.breaker.guard()
+
+    def stats(self):
+        stats = {"timeout": self.timeout, **self.breaker.stats()}
+        if self.bulkhead is not None:
+            stats["bulkhead"] = self.bulkhead.stats()
+        return stats
+
+
+# Response body of a guarded call, gives the bulkhead slot back once it was read or closed
+class _ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self.stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+# httpx transport for the supabase client: every call gets the timeout budget, circuit
+# breaker and bulkhead of its service, classify(request) returns the service name first
+# (metrics.classify_supabase). Transport errors, timeouts and 5xx responses count as failures.
+# Timeouts are raised as UpstreamFailed (504) and connection errors as UpstreamUnavailable
+# (503), so they get through the routers' `except HTTPException: raise` instead of a 500
+class GuardedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport, services, classify):
+        self.transport = transport
+        self.services = services
+        self.classify = classify
+
+    async def handle_async_request(self, request):
+        dependency = self.services.get(self.classify(request)[0])
+        if dependency is None:
+            return await self.transport.handle_async_request(request)
+        request.extensions["timeout"] = httpx.Timeout(dependency.timeout).as_dict()
+        breaker, bulkhead = dependency.breaker, dependency.bulkhead
+        breaker.check()
+        if bulkhead is not None:
+            await bulkhead.acquire()
+        try:
+            breaker.before_call()
+        except UpstreamUnavailable:
+            if bulkhead is not None:
+                bulkhead.release()
+            raise
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError as e:
+            breaker.failure()
+            if bulkhead is not None:
+                bulkhead.release()
+            if isinstance(e, httpx.TimeoutException):
+                raise UpstreamFailed(dependency.name, e, timed_out=True) from e
+            raise UpstreamUnavailable(dependency.name, "connection failed", 1) from e
+        except BaseException:
+            breaker.release()
+            if bulkhead is not None:
+                bulkhead.release()
+            raise
+        if response.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        if bulkhead is None:
+            return response
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, bulkhead.release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+# Circuit state and bulkhead use of every dependency
+def dependency_stats():
+    return {name: dependency.stats() for name, dependency in dependencies.items()}
@@ -0,0 +1,140 @@
+from typing import Dict, List, Optional
+from pydantic import BaseModel, ConfigDict
+
+# Response models for the list / detail endpoints. FastAPI validates the rows and
+# writes the JSON straight from pydantic's rust core when a route has a response
+# model, instead of running jsonable_encoder over every row and then json.dumps.
+# Every column is optional because ?fields= can project any subset, the routes
+# use response_model_exclude_unset so missing columns are left out, not sent as null.
+# Unknown columns (added to the table later) are passed through.
+
+
+class Row(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+
+# ---- blogs ----
+class Blog(Row):
+    id: Optional[str] = None
+    title: Optional[str] = None
+    content: Optional[str] = None
+    thumbnail: Optional[str] = None
+    thumbnail_variants: Optional[Dict[str, str]] = None
+    internal_urls: Optional[List[str]] = None
+    internal_variants: Optional[List[Dict[str, str]]] = None
+    author: Optional[str] = None
+    tags: Optional[List[str]] = None
+    category: Optional[str] = None
+    created_by: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+
+class BlogSummary(Row):
+    id: Optional[str] = None
+    title: Optional[str] = None
+    author: Optional[str] = None
+    category: Optional[str] = None
+    tags: Optional[List[str]] = None
+    thumbnail: Optional[str] = None
+    thumbnail_variants: Optional[Dict[str, str]] = None
+    created_at: Optional[str] = None
+
+
+class BlogSearchResult(BlogSummary):
+    score: float
+
+
+class BlogResponse(BaseModel):
+    blog: Blog
+
+
+class BlogPage(BaseModel):
+    blogs: List[Blog]
+    next_cursor: Optional[str] = None
+
+
+class BlogSummaryPage(BaseModel):
+    blogs: List[BlogSummary]
+    next_cursor: Optional[str] = None
+
+
+# Rows created or updated since the sync token and ids deleted since then
+class BlogChanges(BaseModel):
+    changed: List[Blog]
+    deleted: List[str]
+    sync_token: str
+    has_more: bool
+
+
+class BlogSearchPage(BaseModel):
+    results: List[BlogSearchResult]
+    total: int
+    next_offset: Optional[int] = None
+
+
+class FacetCount(BaseModel):
+    name: str
+    count: int
+
+
+class BlogFacets(BaseModel):
+    tags: List[FacetCount]
+    categories: List[FacetCount]
+
+
+# ---- jobs ----
+class Job(Row):
+    id: Optional[str] = None
+    title: Optional[str] = None
+    department: Optional[str] = None
+    employment_type: Optional[str] = None
+    job_description: Optional[str] = None
+    qualifications: Optional[str] = None
+    salary_range: Optional[str] = None
+    location: Optional[str] = None
+    status: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+
+class JobChanges(BaseModel):
+    changed: List[Job]
+    deleted: List[str]
+    sync_token: str
+    has_more: bool
+
+
+# ---- applications ----
+class JobTitle(Row):
+    title: Optional[str] = None
+
+
+class Application(Row):
+    id: Optional[str] = None
+    job_id: Optional[str] = None
+    title: Optional[str] = None
+    user_email: Optional[str] = None
+    applicant_name: Optional[str] = None
+    resume_url: Optional[str] = None
+    phone_number: Optional[str] = None
+    status: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    jobs: Optional[JobTitle] = None
+
+
+class ApplicationResponse(BaseModel):
+    application: Application
+
+
+class ApplicationPage(BaseModel):
+    applications: List[Application]
+    next_cursor: Optional[str] = None
+
+
+class ApplicationChanges(BaseModel):
+    changed: List[Application]
+    deleted: List[str]
+    sync_token: str
+    has_more: bool
@@ -0,0 +1,37 @@
+import os
+from clients import clients
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+
+# Shared clients from the container in clients.py, built on first use or injected with
+# clients.provide(). Routes call these accessors like the helpers outside of requests do,
+# so one provide() swaps the client everywhere. They also work as Depends(get_supabase)
+def get_supabase():
+    return clients.supabase
+
+
+def get_auth_client():
+    return clients.auth
+
+
+def get_http_client():
+    return clients.http
+
+
+# Upload to supabase storage from an async iterator of chunks, the body is sent
+# with chunked transfer encoding so the file never has to be in memory at once
+async def stream_upload(bucket, path, chunks, content_type):
+    response = await get_http_client().post(
+        f"{SUPABASE_URL}/storage/v1/object/{bucket}/{path}",
+        content=chunks,
+        headers={
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {SUPABASE_KEY}",
+            "content-type": content_type,
+            "x-upsert": "false",
+        },
+    )
+    response.raise_for_status()
+    return response.json()